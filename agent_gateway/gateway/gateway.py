@@ -13,11 +13,20 @@ from __future__ import annotations
 
 import ast
 import asyncio
-import json
 import re
 import threading
 from collections.abc import Sequence
-from typing import Any, Dict, List, Mapping, Optional, Union, cast, ClassVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Union,
+    cast,
+    ClassVar,
+)
 
 from snowflake.connector.connection import SnowflakeConnection
 from snowflake.snowpark import Session
@@ -33,9 +42,13 @@ from agent_gateway.tools.snowflake_prompts import (
 )
 from agent_gateway.tools.utils import (
     CortexEndpointBuilder,
-    _determine_runtime,
-    post_cortex_request,
+    HTTPSessionPool,
+    SnowflakeConnectionPool,
+    get_remaining_time,
+    reset_request_deadline,
+    set_request_deadline,
     set_tag,
+    stream_cortex_request,
     _should_instrument,
 )
 
@@ -43,7 +56,12 @@ from agent_gateway.tools.snowflake_tools import (
     CortexAnalystTool,
     PythonTool,
     CortexSearchTool,
+    FederatedSearchTool,
+    escalate_search,
+    reset_search_escalation,
+    start_search_escalation,
 )
+from agent_gateway.tools.sql_engines import SQLAPIEngine
 
 if _should_instrument():
     from trulens.apps.app import TruApp
@@ -61,35 +79,37 @@ class AgentGatewayError(Exception):
 class CortexCompleteAgent:
     """Self defined agent for Cortex gateway."""
 
-    def __init__(self, session, llm) -> None:
+    def __init__(
+        self, session, llm, http_pool: Optional[HTTPSessionPool] = None
+    ) -> None:
         self.llm = llm
         self.session = session
+        self.http_pool = http_pool
 
     async def arun(self, prompt: str) -> str:
         """Run the LLM."""
+        return "".join([delta async for delta in self.astream(prompt)])
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream the LLM completion as it is generated."""
         headers, url, data = self._prepare_llm_request(prompt=prompt)
+        stream = stream_cortex_request(
+            url=url, headers=headers, data=data, http_pool=self.http_pool
+        )
 
         try:
-            response_text = await post_cortex_request(
-                url=url, headers=headers, data=data
+            async for delta in stream:
+                yield delta
+        except KeyError as e:
+            raise AgentGatewayError(
+                message=f"Missing Cortex LLM response components. {str(e)}"
             )
-
         except Exception as e:
             raise AgentGatewayError(
                 message=f"Failed Cortex LLM Request. See details:{str(e)}"
             ) from e
-
-        try:
-            if _determine_runtime():
-                response_text = json.loads(response_text).get("content")
-
-            snowflake_response = self._parse_snowflake_response(response_text)
-
-            return snowflake_response
-        except Exception:
-            raise AgentGatewayError(
-                message=f"Failed Cortex LLM Request. Unable to parse response. See details:{response_text}"
-            )
+        finally:
+            await stream.aclose()
 
     def _prepare_llm_request(self, prompt):
         eb = CortexEndpointBuilder(self.session)
@@ -99,48 +119,14 @@ class CortexCompleteAgent:
 
         return headers, url, data
 
-    def _parse_snowflake_response(self, data_str):
-        try:
-            json_list = []
-
-            if _determine_runtime():
-                json_list = [i["data"] for i in json.loads(data_str)]
-
-            else:
-                json_objects = data_str.split("\ndata: ")
-
-                # Iterate over each object
-                for obj in json_objects:
-                    obj = obj.strip()
-                    if obj:
-                        # Remove the 'data: ' prefix if it exists
-                        if obj.startswith("data: "):
-                            obj = obj[6:]
-                        # Load the JSON object into a Python dictionary
-                        json_dict = json.loads(str(obj))
-                        # Append the JSON dictionary to the list
-                        json_list.append(json_dict)
-
-            completion = ""
-            choices = {}
-            for chunk in json_list:
-                choices = chunk["choices"][0]
-
-                if "content" in choices["delta"].keys():
-                    completion += choices["delta"]["content"]
-
-            return completion
-        except KeyError as e:
-            raise AgentGatewayError(
-                message=f"Missing Cortex LLM response components. {str(e)}"
-            )
-
 
 class SummarizationAgent(Tool):
-    def __init__(self, session, agent_llm):
+    def __init__(self, session, agent_llm, http_pool=None):
         tool_name = "summarize"
         tool_description = "Concisely summarizes cortex search output"
-        summarizer = CortexCompleteAgent(session=session, llm=agent_llm)
+        summarizer = CortexCompleteAgent(
+            session=session, llm=agent_llm, http_pool=http_pool
+        )
         super().__init__(
             name=tool_name, func=summarizer.arun, description=tool_description
         )
@@ -159,7 +145,9 @@ class Agent:
 
     def __init__(
         self,
-        snowflake_connection: Union[Session, SnowflakeConnection],
+        snowflake_connection: Union[
+            Session, SnowflakeConnection, SnowflakeConnectionPool
+        ],
         tools: list[
             Union[Tool, StructuredTool, CortexAnalystTool, CortexSearchTool, PythonTool]
         ],
@@ -170,6 +158,15 @@ class Agent:
         planner_example_prompt: str = SNOWFLAKE_PLANNER_PROMPT,
         planner_example_prompt_replan: Optional[str] = None,
         fusion_prompt: str = OUTPUT_PROMPT,
+        planner_stream: bool = False,
+        tool_concurrency: Optional[Dict[str, int]] = None,
+        task_timeout: Optional[float] = None,
+        tool_timeouts: Optional[Dict[str, float]] = None,
+        batch_tasks: bool = True,
+        deadline: Optional[float] = None,
+        min_replan_budget: float = 10.0,
+        fuse_reserve: float = 5.0,
+        http_pool: Optional[HTTPSessionPool] = None,
         **kwargs,
     ) -> None:
         """Parameters
@@ -177,7 +174,8 @@ class Agent:
         ----------
 
         Args:
-            snowflake_connection: authenticated Snowflake connection object
+            snowflake_connection: authenticated Snowflake connection object, or a
+                SnowflakeConnectionPool that the tools borrow connections from.
             tools: List of tools to use.
             max_retries: Maximum number of replans to do. Defaults to 2.
             planner_llm: Name of Snowflake Cortex LLM to use for planning.
@@ -189,6 +187,26 @@ class Agent:
                 If not assigned, default to `planner_example_prompt`.
             planner_stop: Stop tokens for planning.
             fusion_prompt: Prompt to use for fusion.
+            planner_stream: Whether to dispatch tasks as soon as each plan line is
+                generated instead of waiting for the whole plan. Defaults to False.
+            tool_concurrency: Maximum number of concurrent tasks per tool name or
+                tool type (e.g. {"CortexAnalystTool": 4}). Unlimited by default.
+            task_timeout: Seconds after which a running task is cancelled. Timed out
+                tasks get a timeout observation and fuse runs on the other results.
+            tool_timeouts: Task timeouts in seconds per tool name or tool type.
+            batch_tasks: Whether sibling tasks of a tool that supports batching
+                (e.g. several searches of one Cortex Search tool) are coalesced
+                into a single batch. Defaults to True.
+            deadline: Default time budget in seconds for each request, shared by
+                planning, tools and fuse. None means no deadline.
+            min_replan_budget: Minimum number of seconds left before the deadline
+                to start a replan. With less time left, the agent answers with
+                the results it already has.
+            fuse_reserve: Seconds of the deadline kept for fuse. Tools are
+                cancelled that long before the deadline, and fuse gets at least
+                that long to answer even when the deadline has passed.
+            http_pool: Connection pool shared by the planner, fuse and the Cortex
+                tools. Defaults to a new HTTPSessionPool owned by the agent.
         """
 
         def _unused_tool():
@@ -226,12 +244,38 @@ class Agent:
             ).plan(inputs={}, is_replan=False)
 
             instrument.method(CortexSearchTool, "asearch")
+            instrument.method(FederatedSearchTool, "asearch")
             instrument.method(CortexAnalystTool, "query")
             instrument.method(CortexAnalystTool, "_process_analyst_message")
             instrument.method(Planner, "plan")
 
+        self.http_pool = http_pool if http_pool is not None else HTTPSessionPool()
+        # Search tools whose number of results escalates when a plan step replans
+        self._escalated_search_tools = {}
+        for tool in tools:
+            pooled_tools = (
+                tool.search_tools if isinstance(tool, FederatedSearchTool) else [tool]
+            )
+            self._escalated_search_tools[tool.name] = [
+                pooled_tool.name
+                for pooled_tool in pooled_tools
+                if isinstance(pooled_tool, CortexSearchTool)
+            ]
+            for pooled_tool in pooled_tools:
+                if isinstance(pooled_tool, (CortexSearchTool, CortexAnalystTool)):
+                    if pooled_tool.http_pool is None:
+                        pooled_tool.http_pool = self.http_pool
+                sql_engine = getattr(pooled_tool, "sql_engine", None)
+                if (
+                    isinstance(sql_engine, SQLAPIEngine)
+                    and sql_engine.http_pool is None
+                ):
+                    sql_engine.http_pool = self.http_pool
+
         summarizer = SummarizationAgent(
-            session=snowflake_connection, agent_llm=agent_llm
+            session=snowflake_connection,
+            agent_llm=agent_llm,
+            http_pool=self.http_pool,
         )
         tools_with_summarizer = tools + [summarizer]
 
@@ -241,12 +285,22 @@ class Agent:
             example_prompt=planner_example_prompt,
             example_prompt_replan=planner_example_prompt_replan,
             tools=tools_with_summarizer,
+            http_pool=self.http_pool,
         )
 
-        self.agent = CortexCompleteAgent(session=snowflake_connection, llm=agent_llm)
+        self.agent = CortexCompleteAgent(
+            session=snowflake_connection, llm=agent_llm, http_pool=self.http_pool
+        )
         self.fusion_prompt = fusion_prompt
         self.fusion_prompt_final = fusion_prompt
-        self.planner_stream = False
+        self.planner_stream = planner_stream
+        self.tool_concurrency = tool_concurrency
+        self.task_timeout = task_timeout
+        self.tool_timeouts = tool_timeouts
+        self.batch_tasks = batch_tasks
+        self.deadline = deadline
+        self.min_replan_budget = min_replan_budget
+        self.fuse_reserve = fuse_reserve
         self.max_retries = max_retries
 
         # basic memory
@@ -259,6 +313,24 @@ class Agent:
         self.executor_callback = None
         gateway_logger.log("INFO", "Cortex gateway successfully initialized")
 
+    def close(self) -> None:
+        """Shut down the thread pool of the pooled requests.
+
+        Only call this once the agent is no longer used, as the thread pool is
+        shared by the calls running on other threads.
+        """
+        self.http_pool.close()
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP connections held for the running event loop."""
+        await self.http_pool.aclose()
+
+    async def __aenter__(self) -> Agent:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
     @property
     def input_keys(self) -> List[str]:
         return [self.input_key]
@@ -378,7 +450,19 @@ class Agent:
             # "---\n"
         )
 
-        response = await self.agent.arun(prompt)
+        # fuse always gets its reserved budget, so that the results gathered
+        # before the deadline are answered instead of failing the request
+        remaining = get_remaining_time()
+        token = (
+            set_request_deadline(max(remaining, self.fuse_reserve))
+            if remaining is not None
+            else None
+        )
+        try:
+            response = await self.agent.arun(prompt)
+        finally:
+            if token is not None:
+                reset_request_deadline(token)
         raw_answer = cast(str, response)
         gateway_logger.log("DEBUG", "Question: \n", input_query, block=True)
         gateway_logger.log("DEBUG", "Raw Answer: \n", raw_answer, block=True)
@@ -465,16 +549,19 @@ class Agent:
     def _call(self, inputs):
         return self.__call__(inputs)
 
-    def __call__(self, input: str) -> Any:
+    def __call__(self, input: str, deadline: Optional[float] = None) -> Any:
         """Calls Cortex gateway multi-agent system.
 
         Params:
             input (str): user's natural language request
+            deadline (float): time budget in seconds, defaults to Agent.deadline
         """
         result = []
         error = []
 
-        thread = threading.Thread(target=self.run_async, args=(input, result, error))
+        thread = threading.Thread(
+            target=self.run_async, args=(input, result, error, deadline)
+        )
         thread.start()
         thread.join()
 
@@ -492,12 +579,12 @@ class Agent:
         loop.default_exception_handler(context)
         loop.stop()
 
-    def run_async(self, input, result, error):
+    def run_async(self, input, result, error, deadline=None):
         loop = asyncio.new_event_loop()
         loop.set_exception_handler(self.handle_exception)
         asyncio.set_event_loop(loop)
         try:
-            task = loop.run_until_complete(self.acall(input))
+            task = loop.run_until_complete(self.acall(input, deadline=deadline))
             result.append(task)
         except asyncio.CancelledError:
             error.append(AgentGatewayError("Task was cancelled"))
@@ -516,13 +603,32 @@ class Agent:
                 loop.run_until_complete(
                     asyncio.gather(*pending, return_exceptions=True)
                 )
+                loop.run_until_complete(self.aclose())
             finally:
                 loop.close()
 
     async def acall(
         self,
         input: str,
+        deadline: Optional[float] = None,
     ) -> Dict[str, Any]:
+        """Asynchronously calls Cortex gateway multi-agent system.
+
+        Params:
+            input (str): user's natural language request
+            deadline (float): time budget in seconds, defaults to Agent.deadline
+        """
+        token = set_request_deadline(
+            deadline if deadline is not None else self.deadline
+        )
+        escalation_token = start_search_escalation()
+        try:
+            return await self._acall(input)
+        finally:
+            reset_search_escalation(escalation_token)
+            reset_request_deadline(token)
+
+    async def _acall(self, input: str) -> Dict[str, Any]:
         sources = []
         contexts = []
         fusion_thought = ""
@@ -538,10 +644,16 @@ class Agent:
             is_first_iter = i == 0
             is_final_iter = i == self.max_retries - 1
 
-            task_processor = TaskProcessor()
+            task_processor = TaskProcessor(
+                concurrency_limits=self.tool_concurrency,
+                task_timeout=self.task_timeout,
+                tool_timeouts=self.tool_timeouts,
+                batch_tasks=self.batch_tasks,
+                fuse_reserve=self.fuse_reserve,
+            )
             if self.planner_stream:
                 task_queue = asyncio.Queue()
-                asyncio.create_task(
+                planner_task = asyncio.create_task(
                     self.planner.aplan(
                         inputs=inputs,
                         task_queue=task_queue,
@@ -554,6 +666,8 @@ class Agent:
                 await task_processor.aschedule(
                     task_queue=task_queue, func=lambda x: None
                 )
+                # Surface planner errors once the scheduler has drained the queue
+                await planner_task
             else:
                 tasks = await self.planner.plan(
                     inputs=inputs,
@@ -585,8 +699,22 @@ class Agent:
             )
             if not is_replan:
                 break
-            else:
-                gateway_logger.log("INFO", "Replanning....")
+
+            remaining = get_remaining_time()
+            if remaining is not None and remaining < self.min_replan_budget:
+                gateway_logger.log(
+                    "INFO",
+                    f"Skipping replan, only {remaining:.1f}s left before the deadline",
+                )
+                break
+            gateway_logger.log("INFO", "Replanning....")
+            escalate_search(
+                [
+                    name
+                    for task in tasks.values()
+                    for name in self._escalated_search_tools.get(task.name, [])
+                ]
+            )
 
             # Collect contexts for the subsequent replanner
             context = self._generate_context_for_replanner(
@@ -601,7 +729,7 @@ class Agent:
             if len(self.memory_context) <= max_memory:
                 self.memory_context.append({"Question:": input, "Answer": answer})
 
-        if is_replan and is_final_iter:
+        if is_replan:
             return {
                 "output": f"{answer} \n Unable to respond to your request with the available information in the system.  Consider rephrasing your request or providing additional tools.",
                 "sources": None,
@@ -630,10 +758,10 @@ if _should_instrument():
                 app_version=app_version,
             )
 
-        def __call__(self, input):
+        def __call__(self, input, deadline=None):
             with self.tru_agent:
-                return self.agent(input)
+                return self.agent(input, deadline=deadline)
 
-        async def acall(self, input):
+        async def acall(self, input, deadline=None):
             with self.tru_agent:
-                return await self.agent.acall(input)
+                return await self.agent.acall(input, deadline=deadline)
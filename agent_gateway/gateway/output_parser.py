@@ -35,10 +35,12 @@ class AgentGatewayError(Exception):
         super().__init__(self.message)
 
 
+def _get_referenced_ids(args: str) -> set[int]:
+    return {int(match) for match in re.findall(ID_PATTERN, args)}
+
+
 def default_dependency_rule(idx, args: str):
-    matches = re.findall(ID_PATTERN, args)
-    numbers = [int(match) for match in matches]
-    return idx in numbers
+    return idx in _get_referenced_ids(args)
 
 
 class GatewayPlanParser:
@@ -214,9 +216,10 @@ def _get_dependencies_from_graph(
         # depends on all previous step IDs
         dependencies = list(range(1, int_idx))
     else:
-        dependencies = [
-            i for i in range(1, int_idx) if default_dependency_rule(i, str(args))
-        ]
+        # $id references are extracted once instead of once per preceding step
+        dependencies = sorted(
+            i for i in _get_referenced_ids(str(args)) if 1 <= i < int_idx
+        )
 
     return [str(d) for d in dependencies]
 
@@ -236,12 +239,16 @@ def instantiate_task(
         args_schema = None
         task_args = ()
         kwargs = None
+        tool_type = None
+        batch_func = None
 
     else:
         tool = _find_tool(tool_name, tools)
         tool_func = tool.func
         stringify_rule = tool.stringify_rule
         args_schema = getattr(tool, "args_schema", None)
+        tool_type = type(tool).__name__
+        batch_func = getattr(tool, "batch_func", None)
         parsed_args = _parse_llm_compiler_action_args(args, args_schema=args_schema)
 
         if isinstance(parsed_args, dict):
@@ -264,4 +271,6 @@ def instantiate_task(
         thought=thought,
         is_fuse=tool_name == "fuse",
         args_schema=args_schema,
+        tool_type=tool_type,
+        batch_tool=batch_func,
     )
@@ -16,26 +16,26 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import re
 from collections.abc import Sequence
-from typing import Any, Optional, Union
+from typing import Any, AsyncIterator, Optional, Union
 
 from agent_gateway.gateway.constants import END_OF_PLAN
 from agent_gateway.gateway.output_parser import (
     ACTION_PATTERN,
     THOUGHT_PATTERN,
     GatewayPlanParser,
+    _check_ref,
+    _create_summarization_step,
     instantiate_task,
 )
 from agent_gateway.gateway.task_processor import Task
 from agent_gateway.tools.base import StructuredTool, Tool
 from agent_gateway.tools.logger import gateway_logger
-from agent_gateway.tools.schema import Plan
 from agent_gateway.tools.utils import (
     CortexEndpointBuilder,
-    _determine_runtime,
-    post_cortex_request,
+    HTTPSessionPool,
+    stream_cortex_request,
 )
 
 
@@ -108,63 +108,108 @@ def generate_gateway_prompt(
 
 
 class StreamingGraphParser:
-    """Streaming version of the GraphParser."""
+    """Streaming version of the GraphParser.
 
-    buffer = ""
-    thought = ""
-    graph_dict = {}
+    Tokens are ingested as the planner LLM generates them and a task is emitted
+    as soon as its plan line is complete. Like GatewayPlanParser, a summarize
+    step is inserted after a cortexsearch action whose successor references a
+    previous output, and later references are renumbered accordingly.
+    """
 
     def __init__(self, tools: Sequence[Union[Tool, StructuredTool]]) -> None:
         self.tools = tools
-
-    def _match_buffer_and_generate_task(self, suffix: str) -> Optional[Task]:
+        self.buffer = ""
+        self.thought = ""
+        self.is_finished = False
+        self._partial_action = ""
+        self._next_idx = 1
+        self._index_mapping: dict[str, str] = {}
+        self._pending_search: Optional[tuple[str, str, str]] = None
+
+    def _match_buffer_and_generate_task(self, line: str) -> list[Task]:
         """Runs every time "\n" is encountered in the input stream or at the end of the stream.
-        Matches the buffer against the regex patterns and generates a task if a match is found.
+        Matches the line against the regex patterns and generates tasks if a match is found.
         Match patterns include:
         1. Thought: <thought>
-          - this case, the thought is stored in self.thought, and we reset the buffer.
+          - this case, the thought is stored in self.thought.
           - the thought is then used as the thought for the next action.
         2. <idx>. <tool_name>(<args>)
           - this case, the tool is instantiated with the idx, tool_name, args, and thought.
           - the thought is reset.
-          - the buffer is reset.
         """
-        if match := re.match(THOUGHT_PATTERN, self.buffer):
+        line = (self._partial_action + line).strip()
+        self._partial_action = ""
+
+        if match := re.match(THOUGHT_PATTERN, line):
             # Optionally, action can be preceded by a thought
             self.thought = match.group(1)
-        elif match := re.match(ACTION_PATTERN, self.buffer):
-            # if action is parsed, return the task, and clear the buffer
-            idx, tool_name, args, _ = match.groups()
-            idx = int(idx)
-            task = instantiate_task(
-                tools=self.tools,
-                idx=idx,
-                tool_name=tool_name,
-                args=args,
-                thought=self.thought,
-            )
+        elif match := re.match(ACTION_PATTERN, line, re.DOTALL):
+            idx, tool_name, args = match.groups()
+            tasks = self._generate_tasks(idx, tool_name, args)
             self.thought = ""
-            return task
-
-        return None
-
-    def ingest_token(self, token: str) -> Optional[Task]:
-        # Append token to buffer
-        if "\n" in token:
-            prefix, suffix = token.split("\n", 1)
-            prefix = prefix.strip()
-            self.buffer += prefix + "\n"
-            matched_item = self._match_buffer_and_generate_task(suffix)
-            self.buffer = suffix
-            return matched_item
-        else:
-            self.buffer += token
+            return tasks
+        elif re.match(r"\d+\. \w+\(", line):
+            # Action arguments may span several lines
+            self._partial_action = line + "\n"
+
+        return []
+
+    def _generate_tasks(self, idx: str, tool_name: str, args: str) -> list[Task]:
+        tasks = []
+
+        if self._pending_search is not None and _check_ref(args):
+            search_ref, search_idx, search_args = self._pending_search
+            summarize_thought, summarize_idx, summarize_name, summarize_args, _ = (
+                _create_summarization_step(search_args, int(search_idx))
+            )
+            tasks.append(
+                instantiate_task(
+                    tools=self.tools,
+                    idx=summarize_idx,
+                    tool_name=summarize_name,
+                    args=summarize_args,
+                    thought=summarize_thought,
+                )
+            )
+            self._index_mapping[search_ref] = summarize_idx
+            self._next_idx += 1
+        self._pending_search = None
+
+        new_idx = str(self._next_idx)
+        self._next_idx += 1
+        args_with_refs = re.sub(
+            r"\$(\d+)",
+            lambda m: f"${self._index_mapping.get(m.group(1), m.group(1))}",
+            args,
+        )
+        self._index_mapping[idx] = new_idx
+        if "cortexsearch" in tool_name:
+            self._pending_search = (idx, new_idx, args)
+
+        task = instantiate_task(
+            tools=self.tools,
+            idx=new_idx,
+            tool_name=tool_name,
+            args=args_with_refs,
+            thought=self.thought,
+        )
+        tasks.append(task)
+        self.is_finished = task.is_fuse
+        return tasks
 
-        return None
+    def ingest_token(self, token: str) -> list[Task]:
+        tasks = []
+        self.buffer += token
+        while "\n" in self.buffer and not self.is_finished:
+            line, self.buffer = self.buffer.split("\n", 1)
+            tasks.extend(self._match_buffer_and_generate_task(line))
+        return tasks
 
-    def finalize(self):
-        self.buffer = self.buffer + "\n"
-        return self._match_buffer_and_generate_task("")
+    def finalize(self) -> list[Task]:
+        line, self.buffer = self.buffer, ""
+        if self.is_finished:
+            return []
+        return self._match_buffer_and_generate_task(line)
 
 
 class Planner:
@@ -175,10 +220,12 @@ class Planner:
         example_prompt: str,
         example_prompt_replan: str,
         tools: Sequence[Union[Tool, StructuredTool]],
+        http_pool: Optional[HTTPSessionPool] = None,
     ):
         self.llm = llm
         self.session = session
         self.tools = tools
+        self.http_pool = http_pool
         tools_without_summarizer = [i for i in self.tools if (i.name != "summarize")]
 
         self.system_prompt = generate_gateway_prompt(
@@ -199,6 +246,18 @@ class Planner:
         is_replan: bool = False,
     ) -> str:
         """Run the LLM."""
+        completion = "".join(
+            [delta async for delta in self.astream_llm(inputs, is_replan=is_replan)]
+        )
+        gateway_logger.log("DEBUG", f"LLM Generated Plan:\n{completion}")
+        return completion
+
+    async def astream_llm(
+        self,
+        inputs: dict[str, Any],
+        is_replan: bool = False,
+    ) -> AsyncIterator[str]:
+        """Stream the plan from the LLM as it is generated."""
         if is_replan:
             system_prompt = self.system_prompt_replan
             assert "context" in inputs, "If replanning, context must be provided"
@@ -209,20 +268,19 @@ class Planner:
 
         message = system_prompt + "\n\n" + human_prompt
         headers, url, data = self._prepare_llm_request(prompt=message)
-        response_text = await post_cortex_request(url=url, headers=headers, data=data)
+        stream = stream_cortex_request(
+            url=url, headers=headers, data=data, http_pool=self.http_pool
+        )
 
         try:
-            if _determine_runtime():
-                response_text = json.loads(response_text).get("content")
-
-            snowflake_response = self._parse_snowflake_response(response_text)
-
-            return snowflake_response
-
-        except Exception:
+            async for delta in stream:
+                yield delta
+        except Exception as e:
             raise AgentGatewayError(
-                message=f"Failed Cortex LLM Request. Unable to parse response. See details:{response_text}"
-            )
+                message=f"Failed Cortex LLM Request. Unable to parse response. See details:{str(e)}"
+            ) from e
+        finally:
+            await stream.aclose()
 
     def _prepare_llm_request(self, prompt):
         eb = CortexEndpointBuilder(self.session)
@@ -232,39 +290,6 @@ class Planner:
 
         return headers, url, data
 
-    def _parse_snowflake_response(self, data_str):
-        json_list = []
-
-        if _determine_runtime():
-            json_list = [i["data"] for i in json.loads(data_str)]
-
-        else:
-            json_objects = data_str.split("\ndata: ")
-
-            # Iterate over each object
-            for obj in json_objects:
-                obj = obj.strip()
-                if obj:
-                    # Remove the 'data: ' prefix if it exists
-                    if obj.startswith("data: "):
-                        obj = obj[6:]
-                    # Load the JSON object into a Python dictionary
-                    json_dict = json.loads(str(obj))
-                    # Append the JSON dictionary to the list
-                    json_list.append(json_dict)
-
-        completion = ""
-        choices = {}
-
-        for chunk in json_list:
-            choices = chunk["choices"][0]
-
-            if "content" in choices["delta"].keys():
-                completion += choices["delta"]["content"]
-
-        gateway_logger.log("DEBUG", f"LLM Generated Plan:\n{completion}")
-        return completion
-
     async def plan(
         self, inputs: dict, is_replan: bool, **kwargs: Any
     ) -> dict[str, Task]:
@@ -279,10 +304,29 @@ class Planner:
     async def aplan(
         self,
         inputs: dict,
-        task_queue: asyncio.Queue[Optional[str]],
+        task_queue: asyncio.Queue[Optional[Task]],
         is_replan: bool,
         **kwargs: Any,
-    ) -> Plan:
-        """Given input, asynchronously decide what to do."""
-        aplan_response = self.run_llm(inputs=inputs, is_replan=is_replan)
-        await aplan_response
+    ) -> None:
+        """Stream the plan and put each task on task_queue as soon as its line is
+        generated. None is put on the queue once the plan is complete."""
+        parser = StreamingGraphParser(tools=self.tools)
+        completion = []
+
+        try:
+            stream = self.astream_llm(inputs=inputs, is_replan=is_replan)
+            try:
+                async for token in stream:
+                    completion.append(token)
+                    for task in parser.ingest_token(token):
+                        await task_queue.put(task)
+                    if parser.is_finished:
+                        break
+            finally:
+                await stream.aclose()
+
+            for task in parser.finalize():
+                await task_queue.put(task)
+            gateway_logger.log("DEBUG", f"LLM Generated Plan:\n{''.join(completion)}")
+        finally:
+            await task_queue.put(None)
@@ -17,14 +17,14 @@ from collections.abc import Collection
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, List, Optional, Type
 import ast
+import re
 
 from agent_gateway.tools.logger import gateway_logger
 from agent_gateway.tools.snowflake_tools import SnowflakeError
+from agent_gateway.tools.utils import convert_table, get_remaining_time, get_table_type
 
 from pydantic import BaseModel
 
-SCHEDULING_INTERVAL = 0.01  # seconds
-
 
 class AgentGatewayError(Exception):
     def __init__(self, message):
@@ -80,6 +80,52 @@ def _replace_arg_mask_with_real_value(
         return args
 
 
+_ARG_MASK_PATTERN = re.compile(r"\s*\$\{?(\d+)\}?\s*")
+
+
+def _replace_arg_mask_with_data(
+    kwargs: Dict[str, Any],
+    args_schema: Type[BaseModel],
+    dependencies: List[str],
+    tasks: Dict[str, Task],
+) -> Dict[str, Any]:
+    """
+    Pass the "data" of a dependency itself, instead of its rendered output, to
+    arguments annotated as pa.Table or pd.DataFrame that are just its
+    placeholder, e.g. "$1".
+    """
+    replaced = dict(kwargs)
+    for key, value in kwargs.items():
+        field = args_schema.model_fields.get(key)
+        table_type = get_table_type(field.annotation) if field is not None else None
+        match = _ARG_MASK_PATTERN.fullmatch(value) if isinstance(value, str) else None
+        if table_type is None or match is None or match[1] not in dependencies:
+            continue
+
+        observation = tasks[match[1]].observation
+        if isinstance(observation, dict) and observation.get("data") is not None:
+            table = convert_table(observation["data"], table_type)
+            if table is not None:
+                replaced[key] = table
+    return replaced
+
+
+def _render_observation(observation: Any) -> Any:
+    """Drops the structured "data" side channel of an observation before it is
+    shown to the LLM."""
+    if isinstance(observation, dict) and "data" in observation:
+        return {key: value for key, value in observation.items() if key != "data"}
+    return observation
+
+
+def _timeout_observation(task: Task, timeout: float) -> Dict[str, Any]:
+    message = (
+        f"{task.name} did not finish within {timeout} seconds and was cancelled. "
+        "No result is available for this step."
+    )
+    return {"output": message, "error": {"type": "timeout", "timeout": timeout}}
+
+
 @dataclass
 class Task:
     idx: str
@@ -93,6 +139,10 @@ class Task:
     observation: Optional[str] = None
     is_fuse: bool = False
     args_schema: Optional[Type[BaseModel]] = None
+    tool_type: Optional[str] = None
+    timeout: Optional[float] = None
+    timed_out: bool = False
+    batch_tool: Optional[Callable] = None
 
     async def __call__(self) -> Any:
         gateway_logger.log("INFO", f"running {self.name} task")
@@ -135,20 +185,154 @@ class Task:
                 )
 
         if self.observation is not None:
-            thought_action_observation += f"Observation: {self.observation}\n"
+            thought_action_observation += (
+                f"Observation: {_render_observation(self.observation)}\n"
+            )
 
         return thought_action_observation
 
 
+class TaskGraph:
+    """Dependency graph of a plan, stored as adjacency lists.
+
+    Plan steps may only reference earlier steps, so the insertion order of the
+    tasks is a topological order and the graph is built in a single pass.
+    """
+
+    def __init__(self):
+        self.dependencies: Dict[str, List[str]] = {}
+        self.dependents: Dict[str, List[str]] = {}
+        self.topological_order: List[str] = []
+        self.critical_path: Dict[str, int] = {}
+        self._critical_path_is_stale = False
+
+    def __contains__(self, task_idx: str) -> bool:
+        return task_idx in self.dependencies
+
+    def __len__(self) -> int:
+        return len(self.topological_order)
+
+    def add_task(self, task_idx: str, dependencies: Collection[str]) -> List[str]:
+        """Add a task and return its dependencies that are part of the graph."""
+        known_dependencies = []
+        for dep in dependencies:
+            if dep in self.dependencies:
+                known_dependencies.append(dep)
+                self.dependents[dep].append(task_idx)
+            else:
+                gateway_logger.log(
+                    "DEBUG", f"Ignoring unknown dependency ${dep} of task {task_idx}"
+                )
+        self.dependencies[task_idx] = known_dependencies
+        self.dependents[task_idx] = []
+        self.topological_order.append(task_idx)
+        self._critical_path_is_stale = True
+        return known_dependencies
+
+    def compute_critical_path(self) -> Dict[str, int]:
+        """Length of the longest downstream chain of every task.
+
+        Computed in one pass in reverse topological order, once the plan is known.
+        """
+        critical_path = {}
+        for task_idx in reversed(self.topological_order):
+            critical_path[task_idx] = 1 + max(
+                (critical_path[dep] for dep in self.dependents[task_idx]), default=0
+            )
+        self.critical_path = critical_path
+        self._critical_path_is_stale = False
+        return critical_path
+
+    def get_critical_path(self, task_idxs: Collection[str]) -> Dict[str, int]:
+        """Longest downstream chain of task_idxs in the graph known so far.
+
+        While a plan is still streamed in, only the downstream tasks of task_idxs
+        are visited instead of recomputing the whole graph.
+        """
+        if not self._critical_path_is_stale:
+            return {idx: self.critical_path[idx] for idx in task_idxs}
+
+        lengths: Dict[str, int] = {}
+        for task_idx in task_idxs:
+            stack = [(task_idx, False)]
+            while stack:
+                current, expanded = stack.pop()
+                if current in lengths:
+                    continue
+                if expanded:
+                    lengths[current] = 1 + max(
+                        (lengths[dep] for dep in self.dependents[current]), default=0
+                    )
+                    continue
+                stack.append((current, True))
+                stack.extend(
+                    (dep, False)
+                    for dep in self.dependents[current]
+                    if dep not in lengths
+                )
+        return {idx: lengths[idx] for idx in task_idxs}
+
+
 class TaskProcessor:
+    """Runs the tasks of a plan as soon as their dependencies complete.
+
+    Scheduling is event driven: each task keeps a count of its unfinished
+    dependencies and, when a task completes, only its dependents in the TaskGraph
+    are updated and the ones without pending dependencies are started right away.
+    """
+
     tasks: Dict[str, Task]
     tasks_done: Dict[str, asyncio.Event]
     remaining_tasks: set[str]
 
-    def __init__(self):
+    def __init__(
+        self,
+        concurrency_limits: Optional[Dict[str, int]] = None,
+        task_timeout: Optional[float] = None,
+        tool_timeouts: Optional[Dict[str, float]] = None,
+        batch_tasks: bool = True,
+        fuse_reserve: float = 0.0,
+    ):
+        """Parameters
+
+        ----------
+
+        Args:
+            concurrency_limits: Maximum number of tasks running at once, keyed by
+                tool name or tool type (e.g. "CortexAnalystTool"). When more tasks
+                are ready than allowed, the ones with the longest chain of
+                downstream tasks are started first.
+            task_timeout: Default number of seconds a task may run before it is
+                cancelled. None means no limit.
+            tool_timeouts: Timeouts in seconds keyed by tool name or tool type.
+                They take precedence over task_timeout, while Task.timeout takes
+                precedence over both.
+            batch_tasks: Whether ready tasks of the same tool are run as a single
+                batch when the tool supports it (e.g. several Cortex Search queries).
+            fuse_reserve: Seconds of the request deadline kept for fuse. Tasks
+                are cancelled that long before the deadline.
+        """
+        for key, limit in (concurrency_limits or {}).items():
+            if limit < 1:
+                raise ValueError(
+                    f"concurrency limit of {key} must be at least 1, got {limit}"
+                )
         self.tasks = {}
         self.tasks_done = {}
         self.remaining_tasks = set()
+        self.graph = TaskGraph()
+        self._pending_dependencies: Dict[str, int] = {}
+        self._ready: List[str] = []
+        self.concurrency_limits = concurrency_limits or {}
+        self.task_timeout = task_timeout
+        self.tool_timeouts = tool_timeouts or {}
+        self.batch_tasks = batch_tasks
+        self.fuse_reserve = fuse_reserve
+        self._slots_in_use: Dict[str, int] = {}
+        self._running: set[asyncio.Task] = set()
+        self._num_done = 0
+        self._accepting_tasks = False
+        self._all_done: Optional[asyncio.Event] = None
 
     def set_tasks(self, tasks: dict[str, Task]):
         # tasks is already keyed by string
@@ -156,22 +340,22 @@ class TaskProcessor:
         self.tasks_done.update({task_idx: asyncio.Event() for task_idx in tasks})
         self.remaining_tasks.update(set(tasks.keys()))
 
-    def _all_tasks_done(self):
-        return all(self.tasks_done[d].is_set() for d in self.tasks_done)
+        for task_idx, task in sorted(tasks.items(), key=lambda item: int(item[0])):
+            dependencies = self.graph.add_task(task_idx, task.dependencies)
+            pending = sum(not self.tasks_done[dep].is_set() for dep in dependencies)
+            self._pending_dependencies[task_idx] = pending
+            if pending == 0:
+                self._ready.append(task_idx)
 
-    def _get_all_executable_tasks(self):
-        return [
-            task_name
-            for task_name in self.remaining_tasks
-            if all(
-                self.tasks_done[dep].is_set()
-                for dep in self.tasks[task_name].dependencies
-            )
-        ]
+    def _all_tasks_done(self):
+        return self._num_done == len(self.tasks)
 
     def _preprocess_args(self, task: Task):
         if task.args_schema is not None:
             if task.kwargs:
+                task.kwargs = _replace_arg_mask_with_data(
+                    task.kwargs, task.args_schema, list(task.dependencies), self.tasks
+                )
                 task.kwargs = _replace_arg_mask_with_real_value(
                     task.kwargs, list(task.dependencies), self.tasks
                 )
@@ -189,48 +373,185 @@ class TaskProcessor:
                 )
 
     async def _run_task(self, task: Task):
-        self._preprocess_args(task)
+        try:
+            self._preprocess_args(task)
+
+            if not task.is_fuse:
+                timeout = self._get_timeout(task)
+                try:
+                    observation = await asyncio.wait_for(task(), timeout)
+                except asyncio.TimeoutError:
+                    task.timed_out = True
+                    observation = _timeout_observation(task, timeout)
+                task.observation = observation
+        except SnowflakeError as e:
+            task.observation = f"SnowflakeError in task: {str(e)}"
+        except Exception as e:
+            task.observation = f"Unexpected Error in task: {str(e)}"
+        finally:
+            self._mark_done(task.idx)
 
-        if not task.is_fuse:
+    async def _run_batch(self, tasks: List[Task]):
+        try:
+            batch = []
+            for task in tasks:
+                try:
+                    self._preprocess_args(task)
+                    batch.append(task)
+                except Exception as e:
+                    task.observation = f"Unexpected Error in task: {str(e)}"
+            if not batch:
+                return
+
+            gateway_logger.log(
+                "INFO", f"running {len(batch)} {tasks[0].name} tasks as one batch"
+            )
+            timeouts = [
+                timeout
+                for timeout in (self._get_timeout(task) for task in batch)
+                if timeout is not None
+            ]
+            timeout = min(timeouts) if timeouts else None
             try:
-                observation = await task()
-                task.observation = observation
-            except SnowflakeError as e:
-                return f"SnowflakeError in task: {str(e)}"
-            except Exception as e:
-                return f"Unexpected Error in task: {str(e)}"
-        self.tasks_done[task.idx].set()
+                observations = await asyncio.wait_for(
+                    batch[0].batch_tool([(task.args, task.kwargs) for task in batch]),
+                    timeout,
+                )
+                for task, observation in zip(batch, observations):
+                    if isinstance(observation, Exception):
+                        observation = (
+                            "Unexpected error during Cortex Gateway Tool request: "
+                            f"{str(observation)}"
+                        )
+                    task.observation = observation
+            except asyncio.TimeoutError:
+                for task in batch:
+                    task.timed_out = True
+                    task.observation = _timeout_observation(task, timeout)
+        except Exception as e:
+            for task in tasks:
+                if task.observation is None:
+                    task.observation = (
+                        f"Unexpected error during Cortex Gateway Tool request: {str(e)}"
+                    )
+        finally:
+            for task in tasks:
+                self._mark_done(task.idx)
+
+    def _mark_done(self, task_idx: str):
+        self.tasks_done[task_idx].set()
+        self._num_done += 1
+        self._release_slots(self.tasks[task_idx])
+
+        for dependent in self.graph.dependents[task_idx]:
+            self._pending_dependencies[dependent] -= 1
+            if self._pending_dependencies[dependent] == 0:
+                self._ready.append(dependent)
+        self._start_ready_tasks()
+
+        if not self._accepting_tasks and self._all_tasks_done():
+            self._all_done.set()
+
+    @staticmethod
+    def _matching_keys(task: Task, settings: Dict[str, Any]) -> List[str]:
+        return [
+            key
+            for key in (task.name, task.tool_type)
+            if key is not None and key in settings
+        ]
 
-    async def schedule(self):
-        """Run all tasks in self.tasks in parallel, respecting dependencies."""
-        while not self._all_tasks_done():
-            executable_tasks = self._get_all_executable_tasks()
+    def _limit_keys(self, task: Task) -> List[str]:
+        return self._matching_keys(task, self.concurrency_limits)
+
+    def _get_timeout(self, task: Task) -> Optional[float]:
+        if task.timeout is not None:
+            timeout = task.timeout
+        else:
+            tool_timeouts = [
+                self.tool_timeouts[key]
+                for key in self._matching_keys(task, self.tool_timeouts)
+            ]
+            timeout = min(tool_timeouts) if tool_timeouts else self.task_timeout
+
+        # Never run past the request deadline, minus the time kept for fuse
+        remaining = get_remaining_time()
+        if remaining is not None:
+            remaining = max(remaining - self.fuse_reserve, 0.0)
+            if timeout is None or remaining < timeout:
+                return remaining
+        return timeout
+
+    def _acquire_slots(self, task: Task) -> bool:
+        keys = self._limit_keys(task)
+        if any(
+            self._slots_in_use.get(key, 0) >= self.concurrency_limits[key]
+            for key in keys
+        ):
+            return False
+        for key in keys:
+            self._slots_in_use[key] = self._slots_in_use.get(key, 0) + 1
+        return True
+
+    def _release_slots(self, task: Task):
+        for key in self._limit_keys(task):
+            self._slots_in_use[key] -= 1
+
+    def _start_ready_tasks(self):
+        if not self._ready:
+            return
+
+        # Critical path first: tasks with the longest downstream chain go first.
+        # The order only matters when concurrency limits hold some tasks back.
+        if self.concurrency_limits and len(self._ready) > 1:
+            critical_path = self.graph.get_critical_path(self._ready)
+            self._ready.sort(key=lambda idx: (-critical_path[idx], int(idx)))
+        waiting = []
+        batches: Dict[str, List[Task]] = {}
+        for task_idx in self._ready:
+            task = self.tasks[task_idx]
+            if not self._acquire_slots(task):
+                waiting.append(task_idx)
+                continue
+            self.remaining_tasks.discard(task_idx)
+            if self.batch_tasks and task.batch_tool is not None:
+                batches.setdefault(task.name, []).append(task)
+            else:
+                self._start(self._run_task(task))
+        self._ready = waiting
 
-            for task_name in executable_tasks:
-                asyncio.create_task(self._run_task(self.tasks[task_name]))
-                self.remaining_tasks.remove(task_name)
+        # Sibling tasks of a tool that supports batching share one request batch
+        for batch in batches.values():
+            if len(batch) == 1:
+                self._start(self._run_task(batch[0]))
+            else:
+                self._start(self._run_batch(batch))
+
+    def _start(self, coroutine):
+        running = asyncio.create_task(coroutine)
+        self._running.add(running)
+        running.add_done_callback(self._running.discard)
 
-            await asyncio.sleep(SCHEDULING_INTERVAL)
+    async def _wait_until_done(self):
+        if not self._all_tasks_done():
+            await self._all_done.wait()
+
+    async def schedule(self):
+        """Run all tasks in self.tasks in parallel, respecting dependencies."""
+        self._all_done = asyncio.Event()
+        self.graph.compute_critical_path()
+        self._start_ready_tasks()
+        await self._wait_until_done()
 
     async def aschedule(self, task_queue: asyncio.Queue[Optional[Task]], func):
         """Asynchronously listen to task_queue and schedule tasks as they arrive."""
-        no_more_tasks = False
-
-        while True:
-            if not no_more_tasks:
-                task = await task_queue.get()
-                if task is None:
-                    no_more_tasks = True
-                else:
-                    self.set_tasks({task.idx: task})
-
-            executable_tasks = self._get_all_executable_tasks()
-
-            if executable_tasks:
-                for task_name in executable_tasks:
-                    asyncio.create_task(self._run_task(self.tasks[task_name]))
-                    self.remaining_tasks.remove(task_name)
-            elif no_more_tasks and self._all_tasks_done():
-                break
-            else:
-                await asyncio.sleep(SCHEDULING_INTERVAL)
+        self._all_done = asyncio.Event()
+        self._accepting_tasks = True
+        try:
+            while (task := await task_queue.get()) is not None:
+                self.set_tasks({task.idx: task})
+                self._start_ready_tasks()
+        finally:
+            self._accepting_tasks = False
+        self.graph.compute_critical_path()
+
+        await self._wait_until_done()
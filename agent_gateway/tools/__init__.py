@@ -12,11 +12,24 @@
 from agent_gateway.tools.snowflake_tools import (
     CortexAnalystTool,
     CortexSearchTool,
+    FederatedSearchTool,
     PythonTool,
+    SearchEscalationPolicy,
     SQLTool,
 )
-
-__all__ = ["CortexAnalystTool", "CortexSearchTool", "PythonTool", "SQLTool", "MCPTool"]
+from agent_gateway.tools.sql_engines import ConnectorSQLEngine, SQLAPIEngine
+
+__all__ = [
+    "CortexAnalystTool",
+    "CortexSearchTool",
+    "ConnectorSQLEngine",
+    "FederatedSearchTool",
+    "PythonTool",
+    "SearchEscalationPolicy",
+    "SQLAPIEngine",
+    "SQLTool",
+    "MCPTool",
+]
 
 
 def is_fastmcp_available():
@@ -16,7 +16,18 @@ import asyncio
 import inspect
 from functools import partial
 from inspect import signature
-from typing import Any, Awaitable, Callable, Dict, Literal, Optional, Tuple, Type, Union
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 from pydantic import BaseModel, Field, create_model, validate_arguments
 
@@ -102,6 +113,8 @@ class Tool:
     """The asynchronous version of the function."""
     stringify_rule: Optional[Callable[..., str]] = None
     args_schema = None
+    batch_func: Optional[Callable[..., Awaitable[List[Any]]]] = None
+    """Optional coroutine running several calls at once, given their (args, kwargs)."""
 
     # --- Runnable ---
 
@@ -0,0 +1,173 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+from snowflake.connector.connection import SnowflakeConnection
+from snowflake.snowpark import Session
+
+from agent_gateway.tools.logger import gateway_logger
+from agent_gateway.tools.utils import SnowflakeConnectionPool
+
+# Session tokens are valid for an hour, renew well before that.
+TOKEN_RENEWAL_INTERVAL = 1800.0
+
+
+class ConnectionHealthManager:
+    """Keeps the Snowflake connections of an agent alive from a background thread.
+
+    Every check_interval seconds, each session is heartbeated and its session
+    token is renewed once it is older than renewal_interval, so that
+    CortexEndpointBuilder always reads a valid token. A connection whose session
+    can no longer be renewed is replaced by a new one, opened off the request
+    path and swapped into the pool atomically. Connections that share the seed's
+    session are checked and renewed together through the seed.
+    """
+
+    def __init__(
+        self,
+        connection: Union[Session, SnowflakeConnection, SnowflakeConnectionPool],
+        check_interval: float = 60.0,
+        renewal_interval: Optional[float] = TOKEN_RENEWAL_INTERVAL,
+    ) -> None:
+        """Parameters
+
+        ----------
+
+        Args:
+            connection: Connection pool to manage. A single Session or connection
+                is managed as a pool of one, which can be renewed but not replaced.
+            check_interval: Seconds between two health checks.
+            renewal_interval: Age in seconds after which a session token is
+                renewed. None only heartbeats the sessions.
+        """
+        if isinstance(connection, SnowflakeConnectionPool):
+            self.pool = connection
+        else:
+            self.pool = SnowflakeConnectionPool(connection, max_size=1)
+        self.check_interval = check_interval
+        self.renewal_interval = renewal_interval
+        self._renewed_at: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> ConnectionHealthManager:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="snowflake-connection-health", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> ConnectionHealthManager:
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                gateway_logger.log("WARNING", f"Connection health check failed: {e}")
+
+    def check(self) -> None:
+        """Heartbeats, renews or replaces every connection of the pool once."""
+        connections = self.pool.connections()
+        if self.pool.shares_session:
+            groups = [
+                [self.pool.connection]
+                + [
+                    connection
+                    for connection in connections
+                    if connection is not self.pool.connection
+                ]
+            ]
+        else:
+            groups = [[connection] for connection in connections]
+
+        alive = set()
+        for group in groups:
+            leader = group[0]
+            alive.update(id(connection) for connection in group)
+            if self._keep_alive(leader):
+                self._share_tokens(leader, group[1:])
+            else:
+                self._replace(group)
+        self._renewed_at = {
+            key: value for key, value in self._renewed_at.items() if key in alive
+        }
+
+    def _keep_alive(self, connection: SnowflakeConnection) -> bool:
+        """Renews the session token when it is due, heartbeats it otherwise."""
+        if connection.is_closed():
+            return False
+        now = time.monotonic()
+        renewed_at = self._renewed_at.setdefault(id(connection), now)
+        try:
+            if (
+                self.renewal_interval is not None
+                and now - renewed_at >= self.renewal_interval
+            ):
+                connection.rest._renew_session()
+                self._renewed_at[id(connection)] = now
+                gateway_logger.log("DEBUG", "Renewed Snowflake session token")
+                return True
+            return bool((connection.rest._heartbeat() or {}).get("success"))
+        except Exception as e:
+            gateway_logger.log("WARNING", f"Snowflake session expired: {e}")
+            return False
+
+    def _share_tokens(
+        self, leader: SnowflakeConnection, connections: List[SnowflakeConnection]
+    ) -> None:
+        for connection in connections:
+            if (
+                connection.rest is not None
+                and connection.rest.token != leader.rest.token
+            ):
+                connection.rest.update_tokens(
+                    leader.rest.token,
+                    leader.rest.master_token,
+                    leader.rest.master_validity_in_seconds,
+                )
+
+    def _replace(self, connections: List[SnowflakeConnection]) -> None:
+        if self.pool.shares_session:
+            gateway_logger.log(
+                "WARNING",
+                "The Snowflake session can not be renewed. Give the connection "
+                "pool connection_params or a connection_factory to reconnect.",
+            )
+            return
+        for connection in connections:
+            try:
+                replacement = self.pool.create_connection()
+            except Exception as e:
+                gateway_logger.log("WARNING", f"Unable to reconnect to Snowflake: {e}")
+                continue
+            self.pool.replace(connection, replacement)
+            self._renewed_at.pop(id(connection), None)
+            self._renewed_at[id(replacement)] = time.monotonic()
+            gateway_logger.log("INFO", "Replaced an expired Snowflake connection")
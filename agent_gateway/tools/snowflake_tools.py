@@ -1,23 +1,43 @@
 from __future__ import annotations
 
 import asyncio
+import copy
 import inspect
 import json
+import math
 import re
-from typing import Any, Dict, List, Type, Union, ClassVar
-import pandas as pd
-
-from pydantic import BaseModel, create_model
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Literal, Optional, Type, Union, ClassVar
+
+import pyarrow as pa
+from pydantic import BaseModel, ConfigDict, create_model
 from snowflake.connector.connection import SnowflakeConnection
 from snowflake.connector import DictCursor
 from snowflake.snowpark import Session
 
 from agent_gateway.tools.logger import gateway_logger
+from agent_gateway.tools.sql_engines import SQLEngine, SQLResult
 from agent_gateway.tools.tools import Tool
 from agent_gateway.tools.utils import (
     CortexEndpointBuilder,
+    HTTPSessionPool,
+    SQL_POLL_INTERVAL,
+    QueryResultRegistry,
+    SnowflakeConnectionPool,
+    TTLCache,
     _get_connection,
+    _get_connection_pool,
+    aborrow_connection,
+    borrow_connection,
+    get_table_type,
+    execute_query,
+    execute_query_async,
+    get_statement_timeout,
     post_cortex_request,
+    summarize_arrow_table,
     _determine_runtime,
 )
 
@@ -25,6 +45,107 @@ from functools import partial
 from inspect import signature
 
 
+METADATA_TTL = 3600.0
+
+
+TARGET_LAG_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def _parse_target_lag(target_lag: Optional[str]) -> Optional[float]:
+    match = re.match(
+        r"\s*(\d+)\s*(second|minute|hour|day)s?\s*$", str(target_lag or ""), re.I
+    )
+    if match is None:
+        return None
+    return int(match[1]) * TARGET_LAG_UNITS[match[2].lower()]
+
+
+FILTER_OPERATORS = ("@eq", "@contains", "@gte", "@lte", "@and", "@or", "@not")
+
+
+def _get_filter_attributes(filter: Any) -> List[str]:
+    """Returns the attributes referenced by a Cortex Search filter expression."""
+    if not isinstance(filter, dict):
+        raise SnowflakeError(message=f"invalid Cortex Search filter: {filter}")
+
+    attributes = []
+    for operator, operand in filter.items():
+        if operator in ("@and", "@or") and isinstance(operand, list):
+            for clause in operand:
+                attributes.extend(_get_filter_attributes(clause))
+        elif operator == "@not":
+            attributes.extend(_get_filter_attributes(operand))
+        elif operator in FILTER_OPERATORS and isinstance(operand, dict):
+            attributes.extend(operand.keys())
+        else:
+            raise SnowflakeError(
+                message=f"invalid Cortex Search filter operator: {operator}"
+            )
+    return attributes
+
+
+class SearchEscalationPolicy:
+    """Grows the number of Cortex Search results each time the agent replans
+
+    In "expand" mode every replan multiplies the number of results by growth,
+    up to max_k. In "page" mode every replan returns the next initial_k results
+    instead of repeating the ones the agent has already seen.
+    """
+
+    def __init__(
+        self,
+        initial_k: int = 3,
+        max_k: int = 20,
+        growth: float = 2.0,
+        mode: Literal["expand", "page"] = "expand",
+    ):
+        if mode not in ("expand", "page"):
+            raise ValueError(f"unknown search escalation mode: {mode}")
+        self.initial_k = initial_k
+        self.max_k = max(max_k, initial_k)
+        self.growth = growth
+        self.mode = mode
+
+    def get_window(self, level: int) -> tuple[int, int]:
+        """Returns the number of results to request and to skip at a level."""
+        if self.mode == "page":
+            limit = min(self.initial_k * (level + 1), self.max_k)
+            return limit, max(limit - self.initial_k, 0)
+        return min(math.ceil(self.initial_k * self.growth**level), self.max_k), 0
+
+
+_search_escalation: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    "search_escalation", default=None
+)
+
+
+def start_search_escalation() -> Token:
+    """Starts tracking search escalation for the current request."""
+    return _search_escalation.set({})
+
+
+def reset_search_escalation(token: Token) -> None:
+    _search_escalation.reset(token)
+
+
+def escalate_search(tool_names: List[str]) -> None:
+    """Moves the given search tools to their next escalation level."""
+    levels = _search_escalation.get()
+    if levels is None:
+        return
+    for name in set(tool_names):
+        levels[name] = levels.get(name, 0) + 1
+
+
+def _search_escalation_level(tool_name: str) -> int:
+    levels = _search_escalation.get()
+    return 0 if levels is None else levels.get(tool_name, 0)
+
+
+ANALYST_MAX_ROWS = 1000
+ANALYST_MAX_BYTES = 8 * 1024 * 1024
+
+
 class SnowflakeError(Exception):
     def __init__(self, message: str):
         self.message = message
@@ -37,8 +158,16 @@ class CortexSearchTool(Tool):
 
     k: int = 5
     retrieval_columns: List[str] = []
+    citation_columns: List[str] = []
+    filter_attributes: List[str] = []
     service_name: str = ""
     connection: Union[Session, SnowflakeConnection] = None
+    connection_pool: Optional[SnowflakeConnectionPool] = None
+    http_pool: Optional[HTTPSessionPool] = None
+    metadata_ttl: Optional[float] = METADATA_TTL
+    result_cache: Optional[TTLCache] = None
+    batch_concurrency: int = 4
+    escalation_policy: Optional[SearchEscalationPolicy] = None
     asearch: ClassVar[Any]
 
     def __init__(
@@ -47,34 +176,172 @@ class CortexSearchTool(Tool):
         service_topic: str,
         data_description: str,
         retrieval_columns: List[str],
-        snowflake_connection: Union[Session, SnowflakeConnection],
+        snowflake_connection: Union[
+            Session, SnowflakeConnection, SnowflakeConnectionPool
+        ],
         k: int = 5,
+        http_pool: Optional[HTTPSessionPool] = None,
+        metadata_ttl: Optional[float] = METADATA_TTL,
+        cache_results: bool = False,
+        cache_size: int = 256,
+        cache_ttl: Optional[float] = None,
+        batch_concurrency: int = 4,
+        citation_columns: Optional[List[str]] = None,
+        filter_attributes: Optional[List[str]] = None,
+        escalation_policy: Optional[SearchEscalationPolicy] = None,
     ):
-        """Initialize CortexSearchTool with parameters."""
+        """Initialize CortexSearchTool with parameters.
+
+        retrieval_columns are returned to the agent, while citation_columns are
+        only fetched for the citations of the response. filter_attributes lists
+        the attributes of the service the planner may filter results on. With an
+        escalation_policy, k adapts to the replans of the agent instead of
+        being fixed.
+
+        Set cache_results to memoize search results in process. Entries expire
+        after cache_ttl seconds, which defaults to the target lag of the search
+        service, and at most cache_size results are kept. batch_concurrency caps
+        the number of concurrent requests of a batch of searches.
+        """
         tool_name = f"{service_name.lower()}_cortexsearch"
         tool_description = self._prepare_search_description(
             name=tool_name,
             service_topic=service_topic,
             data_source_description=data_description,
+            filter_attributes=filter_attributes,
         )
 
-        def search_call(query: str):
-            return self.asearch(query)
+        def search_call(query: str, filter: Optional[Dict[str, Any]] = None):
+            return self.asearch(query, filter=filter)
 
         super().__init__(name=tool_name, description=tool_description, func=search_call)
         self.connection = _get_connection(snowflake_connection)
+        self.connection_pool = _get_connection_pool(snowflake_connection)
         self.k = k
         self.retrieval_columns = retrieval_columns
+        self.citation_columns = citation_columns or []
+        self.filter_attributes = filter_attributes or []
+        self.escalation_policy = escalation_policy
         self.service_name = service_name
+        self.http_pool = http_pool
+        self.metadata_ttl = metadata_ttl
+        self._service_metadata: Optional[Dict[str, Any]] = None
+        self._metadata_loaded_at = 0.0
+        self._metadata_lock = threading.Lock()
+        self.result_cache = (
+            TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_results else None
+        )
+        self.batch_concurrency = batch_concurrency
+        self.batch_func = self._abatch_call
         gateway_logger.log("INFO", "Cortex Search Tool successfully initialized")
 
-    def __call__(self, question) -> Any:
-        return self.asearch(question)
+    def __call__(self, question, filter: Optional[Dict[str, Any]] = None) -> Any:
+        return self.asearch(question, filter=filter)
 
-    async def asearch(self, query: str) -> Dict[str, Any]:
+    async def asearch(
+        self, query: str, filter: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         gateway_logger.log("DEBUG", f"Cortex Search Query: {query}")
-        headers, url, data = self._prepare_request(query=query)
-        response_text = await post_cortex_request(url=url, headers=headers, data=data)
+        headers, url = self._prepare_endpoint()
+        search_response = await self._afetch_results(query, headers, url, filter)
+        search_col = await self._aget_search_column()
+        return self._format_response(search_response, search_col)
+
+    async def abatch_search(
+        self,
+        queries: List[str],
+        max_concurrency: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Runs several searches concurrently and merges their results.
+
+        Parameters
+
+        ----------
+
+        Args:
+            queries: Search queries to run against the service.
+            max_concurrency: Maximum number of requests in flight at once.
+                Defaults to the batch_concurrency of the tool.
+            filter: Cortex Search filter applied to every query.
+
+        Returns:
+            Dict[str, Any]: the deduplicated results of all queries and their
+                citations, in the same format as asearch.
+        """
+        gateway_logger.log("DEBUG", f"Cortex Search Batch Queries: {queries}")
+        responses = await self._asearch_many(
+            queries, max_concurrency, [filter] * len(queries)
+        )
+        for response in responses:
+            if isinstance(response, Exception):
+                raise response
+
+        seen = set()
+        merged = []
+        for row in (row for response in responses for row in response):
+            identifier = json.dumps(row, sort_keys=True, default=str)
+            if identifier not in seen:
+                seen.add(identifier)
+                merged.append(row)
+
+        search_col = await self._aget_search_column()
+        return self._format_response(merged, search_col)
+
+    async def _abatch_call(self, calls: List[tuple]) -> List[Any]:
+        """Runs the (args, kwargs) of several tasks as one batch, one result each."""
+        queries, filters = [], []
+        for args, kwargs in calls:
+            arguments = signature(self.asearch).bind(*args, **kwargs).arguments
+            queries.append(arguments["query"])
+            filters.append(arguments.get("filter"))
+        responses = await self._asearch_many(queries, filters=filters)
+        search_col = await self._aget_search_column()
+        return [
+            response
+            if isinstance(response, Exception)
+            else self._format_response(response, search_col)
+            for response in responses
+        ]
+
+    async def _asearch_many(
+        self,
+        queries: List[str],
+        max_concurrency: Optional[int] = None,
+        filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> List[Union[List[Dict[str, Any]], Exception]]:
+        headers, url = self._prepare_endpoint()
+        semaphore = asyncio.Semaphore(max_concurrency or self.batch_concurrency)
+        filters = filters or [None] * len(queries)
+
+        async def search(query: str, filter: Optional[Dict[str, Any]]):
+            async with semaphore:
+                return await self._afetch_results(query, headers, url, filter)
+
+        return await asyncio.gather(
+            *[search(query, filter) for query, filter in zip(queries, filters)],
+            return_exceptions=True,
+        )
+
+    async def _afetch_results(
+        self,
+        query: str,
+        headers: Dict[str, str],
+        url: str,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        limit, offset = self._get_result_window()
+        data = self._prepare_request_data(query, filter, limit)
+        if self.result_cache is not None:
+            cache_key = self._get_cache_key(data)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                gateway_logger.log("DEBUG", "Cortex Search cache hit")
+                return copy.deepcopy(cached)[offset:]
+
+        response_text = await post_cortex_request(
+            url=url, headers=headers, data=data, http_pool=self.http_pool
+        )
 
         response_json = json.loads(response_text)
 
@@ -88,13 +355,29 @@ class CortexSearchTool(Tool):
                 message=f"unable to parse Cortex Search response {response_json.get('message', 'Unknown error')}"
             )
 
-        search_col = self._get_search_column(self.service_name)
-        citations = self._get_citations(search_response, search_col)
-
         gateway_logger.log("DEBUG", f"Cortex Search Response: {search_response}")
 
+        if self.result_cache is not None:
+            await self._aget_service_metadata()
+            self.result_cache.set(
+                cache_key, copy.deepcopy(search_response), ttl=self._get_cache_ttl()
+            )
+        return search_response[offset:]
+
+    def _get_result_window(self) -> tuple[int, int]:
+        """Returns the number of results to request and how many to skip."""
+        if self.escalation_policy is None:
+            return self.k, 0
+        level = _search_escalation_level(self.name)
+        return self.escalation_policy.get_window(level)
+
+    def _format_response(
+        self, search_response: List[Dict[str, Any]], search_col: List[str]
+    ) -> Dict[str, Any]:
+        citations = self._get_citations(search_response, search_col)
+
         return {
-            "output": search_response,
+            "output": [self._project_row(row) for row in search_response],
             "sources": {
                 "tool_type": "cortex_search",
                 "tool_name": self.name,
@@ -102,32 +385,95 @@ class CortexSearchTool(Tool):
             },
         }
 
-    def _prepare_request(self, query: str) -> tuple:
-        eb = CortexEndpointBuilder(self.connection)
+    def _get_cache_key(self, data: Dict[str, Any]) -> tuple:
+        return (
+            self.connection.database,
+            self.connection.schema,
+            self.service_name,
+            # only whitespace, as the ranking of Cortex Search may depend on case
+            " ".join(data["query"].split()),
+            tuple(data["columns"]),
+            data["limit"],
+            json.dumps(data.get("filter"), sort_keys=True),
+        )
+
+    def _get_cache_ttl(self) -> Optional[float]:
+        if self.result_cache.ttl is not None:
+            return None
+        target_lag = _parse_target_lag(self._service_metadata.get("target_lag"))
+        return target_lag if target_lag is not None else METADATA_TTL
+
+    def _prepare_endpoint(self) -> tuple:
+        eb = CortexEndpointBuilder(self.connection_pool or self.connection)
         headers = eb.get_search_headers()
         url = eb.get_search_endpoint(
             self.connection.database,
             self.connection.schema,
             self.service_name,
         )
+        return headers, url
 
+    def _prepare_request_data(
+        self,
+        query: str,
+        filter: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
         data = {
             "query": query,
-            "columns": self.retrieval_columns,
-            "limit": self.k,
+            "columns": list(
+                dict.fromkeys(list(self.retrieval_columns) + self.citation_columns)
+            ),
+            "limit": limit or self.k,
         }
+        filter = self._validate_filter(filter)
+        if filter:
+            data["filter"] = filter
+        return data
+
+    def _validate_filter(
+        self, filter: Optional[Union[str, Dict[str, Any]]]
+    ) -> Optional[Dict[str, Any]]:
+        if not filter:
+            return None
+        if isinstance(filter, str):
+            try:
+                filter = json.loads(filter)
+            except json.JSONDecodeError:
+                raise SnowflakeError(
+                    message=f"Cortex Search filter is not valid JSON: {filter}"
+                )
+
+        attributes = _get_filter_attributes(filter)
+        allowed = {attribute.upper() for attribute in self.filter_attributes}
+        unknown = [a for a in attributes if a.upper() not in allowed]
+        if unknown:
+            raise SnowflakeError(
+                message=f"Cortex Search filter uses unknown attributes {unknown}, "
+                f"filterable attributes are {self.filter_attributes}"
+            )
+        return filter
 
-        return headers, url, data
+    def _project_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        citation_only = set(self.citation_columns) - set(self.retrieval_columns)
+        if not citation_only:
+            return row
+        return {k: v for k, v in row.items() if k not in citation_only}
 
     def _get_citations(
         self, raw_response: List[Dict[str, Any]], search_column: List[str]
     ) -> List[Dict[str, Any]]:
-        citation_elements = [
-            {k: v for k, v in d.items() if k and k not in search_column}
-            for d in raw_response
-        ]
+        if self.citation_columns:
+            citation_elements = [
+                {k: d[k] for k in self.citation_columns if k in d} for d in raw_response
+            ]
+        else:
+            citation_elements = [
+                {k: v for k, v in d.items() if k and k not in search_column}
+                for d in raw_response
+            ]
 
-        if len(citation_elements[0].keys()) < 1:
+        if not citation_elements or len(citation_elements[0].keys()) < 1:
             return [{"Search Tool": self.service_name}]
 
         seen = set()
@@ -141,14 +487,93 @@ class CortexSearchTool(Tool):
         return citations
 
     def _prepare_search_description(
-        self, name: str, service_topic: str, data_source_description: str
+        self,
+        name: str,
+        service_topic: str,
+        data_source_description: str,
+        filter_attributes: Optional[List[str]] = None,
     ) -> str:
+        if not filter_attributes:
+            return (
+                f""""{name}(query: str) -> list:\n"""
+                f""" - Executes a search for relevant information about {service_topic}.\n"""
+                f""" - Returns a list of relevant passages from {data_source_description}.\n"""
+            )
+
+        example = json.dumps({"@eq": {filter_attributes[0]: "<value>"}})
         return (
-            f""""{name}(query: str) -> list:\n"""
+            f""""{name}(query: str, filter: Optional[dict] = None) -> list:\n"""
             f""" - Executes a search for relevant information about {service_topic}.\n"""
+            f""" - filter narrows the search to passages whose attributes {", ".join(filter_attributes)} match, e.g. {example}.\n"""
+            f""" - filter supports the operators {", ".join(FILTER_OPERATORS)}.\n"""
             f""" - Returns a list of relevant passages from {data_source_description}.\n"""
         )
 
+    def refresh_metadata(self) -> Dict[str, Any]:
+        """Reloads the cached search service metadata from Snowflake.
+
+        Parameters
+
+        ----------
+
+        Returns:
+            Dict[str, Any]: the SHOW CORTEX SEARCH SERVICES row for this service.
+        """
+        with self._metadata_lock:
+            return self._load_metadata()
+
+    def _load_metadata(self) -> Dict[str, Any]:
+        # the caller holds _metadata_lock
+        with borrow_connection(self.connection, self.connection_pool) as connection:
+            service_name = self.service_name.replace("'", "''")
+            rows = (
+                connection.cursor(cursor_class=DictCursor)
+                .execute(f"SHOW CORTEX SEARCH SERVICES LIKE '{service_name}'")
+                .fetchall()
+            )
+            matches = [
+                row
+                for row in rows
+                if str(row.get("name", "")).upper() == self.service_name.upper()
+            ]
+            exact = [row for row in matches if row["name"] == self.service_name]
+            metadata = (exact or matches or [{}])[0]
+            self._service_metadata = metadata
+            self._metadata_loaded_at = time.monotonic()
+            gateway_logger.log(
+                "DEBUG", f"Loaded Cortex Search metadata for {self.service_name}"
+            )
+            return metadata
+
+    def _metadata_is_stale(self) -> bool:
+        if self._service_metadata is None:
+            return True
+        if self.metadata_ttl is None:
+            return False
+        return time.monotonic() - self._metadata_loaded_at >= self.metadata_ttl
+
+    def _get_service_metadata(self) -> Dict[str, Any]:
+        if self._metadata_is_stale():
+            return self._refresh_stale_metadata()
+        return self._service_metadata
+
+    def _refresh_stale_metadata(self) -> Dict[str, Any]:
+        """Reloads the metadata, unless a concurrent caller already did."""
+        with self._metadata_lock:
+            if self._metadata_is_stale():
+                return self._load_metadata()
+            return self._service_metadata
+
+    async def _aget_search_column(self) -> List[str]:
+        await self._aget_service_metadata()
+        return self._get_search_column(self.service_name)
+
+    async def _aget_service_metadata(self) -> Dict[str, Any]:
+        if self._metadata_is_stale():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._refresh_stale_metadata)
+        return self._service_metadata
+
     def _get_search_column(self, search_service_name: str) -> List[str]:
         column = self._get_search_service_attribute(
             search_service_name, "search_column"
@@ -163,32 +588,147 @@ class CortexSearchTool(Tool):
     def _get_search_service_attribute(
         self, search_service_name: str, attribute: str
     ) -> List[str]:
-        df = (
-            self.connection.cursor(cursor_class=DictCursor)
-            .execute("SHOW CORTEX SEARCH SERVICES")
-            .fetchall()
-        )
-        df = pd.DataFrame(df)
+        raw_atts = self._get_service_metadata().get(attribute)
 
-        if not df.empty:
-            raw_atts = df.loc[df["name"] == search_service_name, attribute].iloc[0]
+        if raw_atts:
             return raw_atts.split(",")
         else:
             return None
 
     def _get_search_table(self, search_service_name: str) -> str:
-        df = (
-            self.connection.cursor(cursor_class=DictCursor)
-            .execute("SHOW CORTEX SEARCH SERVICES")
-            .fetch_pandas_all()
-        )
-        df = pd.DataFrame(df)
-        table_def = df.loc[df["name"] == search_service_name, "definition"].iloc[0]
+        table_def = self._get_service_metadata().get("definition") or ""
         pattern = r"FROM\s+([\w\.]+)"
         match = re.search(pattern, table_def)
         return match[1] if match else "No match found."
 
 
+class FederatedSearchTool(Tool):
+    """Cortex Search tool that searches several Cortex Search services at once
+
+    The query is sent to every service in parallel and the results are merged
+    with reciprocal rank fusion into a single top-k list, so one planner action
+    covers all of the underlying corpora.
+    """
+
+    k: int = 5
+    rrf_k: int = 60
+    search_tools: List[CortexSearchTool] = []
+    asearch: ClassVar[Any]
+
+    def __init__(
+        self,
+        search_tools: List[CortexSearchTool],
+        service_topic: str,
+        data_description: str,
+        name: str = "federated_cortexsearch",
+        k: int = 5,
+        rrf_k: int = 60,
+    ):
+        """Initialize FederatedSearchTool with parameters.
+
+        search_tools are the Cortex Search tools to fan out to, k is the number
+        of merged results and rrf_k the rank constant of reciprocal rank fusion.
+        k grows with the search tools whose escalation policy is in "expand" mode.
+        """
+        if not search_tools:
+            raise SnowflakeError(
+                message="FederatedSearchTool requires at least one search tool"
+            )
+        tool_description = (
+            f""""{name}(query: str) -> list:\n"""
+            f""" - Executes a search for relevant information about {service_topic} across several sources.\n"""
+            f""" - Returns a list of relevant passages from {data_description}.\n"""
+        )
+
+        def search_call(query: str):
+            return self.asearch(query)
+
+        super().__init__(name=name, description=tool_description, func=search_call)
+        self.search_tools = search_tools
+        self.k = k
+        self.rrf_k = rrf_k
+        gateway_logger.log("INFO", "Federated Search Tool successfully initialized")
+
+    def __call__(self, question) -> Any:
+        return self.asearch(question)
+
+    async def asearch(self, query: str) -> Dict[str, Any]:
+        gateway_logger.log("DEBUG", f"Federated Search Query: {query}")
+        responses = await asyncio.gather(
+            *[
+                tool._afetch_results(query, *tool._prepare_endpoint())
+                for tool in self.search_tools
+            ],
+            return_exceptions=True,
+        )
+
+        ranked_lists = []
+        for tool, response in zip(self.search_tools, responses):
+            if isinstance(response, Exception):
+                gateway_logger.log(
+                    "WARNING",
+                    f"Search of {tool.service_name} failed: {str(response)}",
+                )
+            else:
+                ranked_lists.append((tool, response))
+        if not ranked_lists:
+            raise SnowflakeError(message="all federated Cortex Search requests failed")
+
+        results = self._fuse_results(ranked_lists)
+        citations = await self._get_federated_citations(results)
+
+        return {
+            "output": [tool._project_row(row) for tool, row in results],
+            "sources": {
+                "tool_type": "cortex_search",
+                "tool_name": self.name,
+                "metadata": citations,
+            },
+        }
+
+    def _fuse_results(
+        self, ranked_lists: List[tuple]
+    ) -> List[tuple[CortexSearchTool, Dict[str, Any]]]:
+        """Reciprocal rank fusion of the result lists of each service."""
+        scores: Dict[str, float] = {}
+        rows: Dict[str, tuple] = {}
+        for tool, ranked in ranked_lists:
+            for rank, row in enumerate(ranked, start=1):
+                identifier = json.dumps(row, sort_keys=True, default=str)
+                scores[identifier] = scores.get(identifier, 0.0) + 1.0 / (
+                    self.rrf_k + rank
+                )
+                rows.setdefault(identifier, (tool, row))
+
+        top = sorted(scores, key=scores.get, reverse=True)[: self._get_result_limit()]
+        return [rows[identifier] for identifier in top]
+
+    def _get_result_limit(self) -> int:
+        """Grows k as much as the search tools in "expand" mode have grown."""
+        growth = 1.0
+        for tool in self.search_tools:
+            policy = tool.escalation_policy
+            if policy is not None and policy.mode == "expand":
+                limit, _ = tool._get_result_window()
+                growth = max(growth, limit / policy.initial_k)
+        return math.ceil(self.k * growth)
+
+    async def _get_federated_citations(
+        self, results: List[tuple[CortexSearchTool, Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        seen = set()
+        citations = []
+        for tool, row in results:
+            search_col = await tool._aget_search_column()
+            for citation in tool._get_citations([row], search_col):
+                citation = {**citation, "Search Tool": tool.service_name}
+                identifier = tuple(sorted(citation.items()))
+                if identifier not in seen:
+                    seen.add(identifier)
+                    citations.append(citation)
+        return citations
+
+
 def get_min_length(model: Type[BaseModel]) -> int:
     min_length = 0
     for key, field in model.model_fields.items():
@@ -204,6 +744,15 @@ class CortexAnalystTool(Tool):
     STAGE: str = ""
     FILE: str = ""
     connection: Union[Session, SnowflakeConnection] = None
+    connection_pool: Optional[SnowflakeConnectionPool] = None
+    http_pool: Optional[HTTPSessionPool] = None
+    max_rows: Optional[int] = ANALYST_MAX_ROWS
+    max_bytes: Optional[int] = ANALYST_MAX_BYTES
+    result_format: str = "rows"
+    summary_threshold: int = 100
+    sql_cache: Optional[TTLCache] = None
+    model_check_interval: float = 60.0
+    result_registry: Optional[QueryResultRegistry] = None
     asearch: ClassVar[Any]
     _process_analyst_message: ClassVar[Any]
 
@@ -213,10 +762,44 @@ class CortexAnalystTool(Tool):
         stage: str,
         service_topic: str,
         data_description: str,
-        snowflake_connection: Union[Session, SnowflakeConnection],
+        snowflake_connection: Union[
+            Session, SnowflakeConnection, SnowflakeConnectionPool
+        ],
         max_results: int = None,
+        http_pool: Optional[HTTPSessionPool] = None,
+        poll_interval: float = SQL_POLL_INTERVAL,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = ANALYST_MAX_BYTES,
+        result_format: Literal["rows", "summary", "auto"] = "rows",
+        summary_threshold: int = 100,
+        cache_sql: bool = False,
+        sql_cache_ttl: Optional[float] = 3600.0,
+        sql_cache_size: int = 256,
+        model_check_interval: float = 60.0,
+        result_reuse_window: Optional[float] = None,
+        sql_engine: Optional[SQLEngine] = None,
     ):
-        """Initialize CortexAnalystTool with parameters."""
+        """Initialize CortexAnalystTool with parameters.
+
+        max_rows and max_bytes cap the result set fetched for each question.
+        max_rows defaults to max_results, or ANALYST_MAX_ROWS when it is unset.
+        result_format controls what the agent sees of a result: all "rows", a
+        columnar "summary", or "auto" to summarize results with more than
+        summary_threshold rows. The full table is always kept in the "data" key
+        of the tool output.
+
+        Set cache_sql to reuse the SQL generated for a question for
+        sql_cache_ttl seconds instead of asking Cortex Analyst again. The cache
+        is cleared when the semantic model file changes on the stage, which is
+        checked at most every model_check_interval seconds.
+
+        With result_reuse_window, SQL that was executed in the last
+        result_reuse_window seconds is answered from its persisted result
+        instead of running again on the warehouse.
+
+        sql_engine runs the generated SQL instead of the Python connector, e.g.
+        a SQLAPIEngine that shares the HTTP pool with the Cortex calls.
+        """
         tname = semantic_model.replace(".yaml", "") + "_" + "cortexanalyst"
         tool_description = self._prepare_analyst_description(
             name=tname,
@@ -229,9 +812,30 @@ class CortexAnalystTool(Tool):
 
         super().__init__(name=tname, func=analyst_call, description=tool_description)
         self.connection = _get_connection(snowflake_connection)
+        self.connection_pool = _get_connection_pool(snowflake_connection)
         self.FILE = semantic_model
         self.STAGE = stage
         self.max_results = max_results
+        self.http_pool = http_pool
+        self.poll_interval = poll_interval
+        if max_rows is None:
+            max_rows = max_results if max_results is not None else ANALYST_MAX_ROWS
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        if result_format not in ("rows", "summary", "auto"):
+            raise ValueError(f"unknown Cortex Analyst result format: {result_format}")
+        self.result_format = result_format
+        self.summary_threshold = summary_threshold
+        self.sql_cache = (
+            TTLCache(maxsize=sql_cache_size, ttl=sql_cache_ttl) if cache_sql else None
+        )
+        self.model_check_interval = model_check_interval
+        self.result_registry = (
+            QueryResultRegistry(result_reuse_window) if result_reuse_window else None
+        )
+        self.sql_engine = sql_engine
+        self._model_version: Optional[tuple] = None
+        self._model_checked_at: Optional[float] = None
 
         gateway_logger.log("INFO", "Cortex Analyst Tool successfully initialized")
 
@@ -245,9 +849,20 @@ class CortexAnalystTool(Tool):
 
     async def query(self, query):
         gateway_logger.log("DEBUG", f"Cortex Analyst Prompt:{query}")
+        cache_key = None
+        if self.sql_cache is not None:
+            await self._acheck_semantic_model()
+            cache_key = (self._get_semantic_model_path(), " ".join(query.split()))
+            cached = self.sql_cache.get(cache_key)
+            if cached is not None:
+                gateway_logger.log("DEBUG", "Cortex Analyst SQL cache hit")
+                return await self._process_analyst_message(copy.deepcopy(cached))
+
         url, headers, data = self._prepare_analyst_request(prompt=query)
 
-        response_text = await post_cortex_request(url=url, headers=headers, data=data)
+        response_text = await post_cortex_request(
+            url=url, headers=headers, data=data, http_pool=self.http_pool
+        )
         json_response = json.loads(response_text)
 
         gateway_logger.log("DEBUG", f"Cortex Analyst Raw Response: {json_response}")
@@ -255,33 +870,78 @@ class CortexAnalystTool(Tool):
         try:
             if _determine_runtime() and isinstance(json_response["content"], str):
                 json_response["content"] = json.loads(json_response["content"])
-                query_response = self._process_analyst_message(
-                    json_response["content"]["message"]["content"]
-                )
+                content = json_response["content"]["message"]["content"]
             else:
-                x = json_response["message"]["content"]
-                query_response = self._process_analyst_message(x)
+                content = json_response["message"]["content"]
+            query_response = await self._process_analyst_message(content)
 
+            if cache_key is not None and any(
+                item.get("type") == "sql" for item in content
+            ):
+                self.sql_cache.set(cache_key, copy.deepcopy(content))
             return query_response
 
         except KeyError:
             raise SnowflakeError(message=json_response.get("message", "Unknown error"))
 
+    def _get_semantic_model_path(self) -> str:
+        return f"@{self.connection.database}.{self.connection.schema}.{self.STAGE}/{self.FILE}"
+
+    def _get_semantic_model_version(self) -> Optional[tuple]:
+        with borrow_connection(self.connection, self.connection_pool) as connection:
+            rows = (
+                connection.cursor(cursor_class=DictCursor)
+                .execute(f"LIST {self._get_semantic_model_path()}")
+                .fetchall()
+            )
+        for row in rows:
+            if row["name"].split("/")[-1] == self.FILE:
+                return row.get("md5"), row.get("last_modified")
+        return None
+
+    async def _acheck_semantic_model(self) -> None:
+        """Clears the SQL cache if the semantic model file changed on the stage."""
+        now = time.monotonic()
+        if (
+            self._model_checked_at is not None
+            and now - self._model_checked_at < self.model_check_interval
+        ):
+            return
+        self._model_checked_at = now
+
+        try:
+            version = await asyncio.get_running_loop().run_in_executor(
+                None, self._get_semantic_model_version
+            )
+        except Exception as e:
+            gateway_logger.log(
+                "WARNING", f"Unable to check semantic model {self.FILE}: {str(e)}"
+            )
+            version = None
+
+        if version is None or version != self._model_version:
+            if len(self.sql_cache):
+                gateway_logger.log(
+                    "INFO", f"Semantic model {self.FILE} changed, clearing SQL cache"
+                )
+            self.sql_cache.clear()
+        self._model_version = version
+
     def _prepare_analyst_request(self, prompt: str) -> tuple:
         data = {
             "messages": [
                 {"role": "user", "content": [{"type": "text", "text": prompt}]}
             ],
-            "semantic_model_file": f"@{self.connection.database}.{self.connection.schema}.{self.STAGE}/{self.FILE}",
+            "semantic_model_file": self._get_semantic_model_path(),
         }
 
-        eb = CortexEndpointBuilder(self.connection)
+        eb = CortexEndpointBuilder(self.connection_pool or self.connection)
         headers = eb.get_analyst_headers()
         url = eb.get_analyst_endpoint()
 
         return url, headers, data
 
-    def _process_analyst_message(self, response) -> Dict[str, Any]:
+    async def _process_analyst_message(self, response) -> Dict[str, Any]:
         if isinstance(response, list) and len(response) > 0:
             gateway_logger.log("DEBUG", response)
             sql_exists = any(item.get("type") == "sql" for item in response)
@@ -289,14 +949,33 @@ class CortexAnalystTool(Tool):
             for item in response:
                 if item["type"] == "sql":
                     sql_query = item["statement"]
-                    table = (
-                        self.connection.cursor().execute(sql_query).fetch_arrow_all()
-                    )
+                    if self.sql_engine is not None:
+                        result = await self.sql_engine.execute(sql_query)
+                        table, truncation_note = await self._afetch_capped_result(
+                            result
+                        )
+                    else:
+                        async with aborrow_connection(
+                            self.connection, self.connection_pool
+                        ) as connection:
+                            cursor = await execute_query_async(
+                                connection,
+                                sql_query,
+                                poll_interval=self.poll_interval,
+                                result_registry=self.result_registry,
+                            )
+                            (
+                                table,
+                                truncation_note,
+                            ) = await asyncio.get_running_loop().run_in_executor(
+                                None, self._fetch_capped_table, cursor
+                            )
 
                     if table:
                         tables = self._extract_tables(sql_query)
                         return {
-                            "output": str(table.to_pydict()),
+                            "output": self._render_table(table) + truncation_note,
+                            "data": table,
                             "sources": {
                                 "tool_type": "cortex_analyst",
                                 "tool_name": self.name,
@@ -334,6 +1013,91 @@ class CortexAnalystTool(Tool):
 
         raise SnowflakeError(message="Invalid Cortex Analyst Response")
 
+    def _render_table(self, table: pa.Table) -> str:
+        if self.result_format == "summary" or (
+            self.result_format == "auto" and table.num_rows > self.summary_threshold
+        ):
+            return str(summarize_arrow_table(table))
+        return str(table.to_pydict())
+
+    def _fetch_capped_table(self, cursor) -> tuple:
+        """Fetches result batches until max_rows or max_bytes is reached.
+
+        Returns the fetched table, or None without results, and a note telling
+        the agent how many rows were left out.
+        """
+        batches = []
+        num_rows = 0
+        num_bytes = 0
+        truncated = False
+        for batch in cursor.fetch_arrow_batches():
+            keep, num_bytes = self._get_rows_to_keep(batch, num_rows, num_bytes)
+            if keep > 0:
+                batches.append(batch.slice(0, keep))
+                num_rows += keep
+            if keep < batch.num_rows:
+                truncated = True
+                break
+            # skip downloading a batch only to learn that it is cut off
+            if num_rows == self.max_rows and (cursor.rowcount or 0) > num_rows:
+                truncated = True
+                break
+
+        return self._combine_capped_batches(batches, truncated, cursor.rowcount)
+
+    async def _afetch_capped_result(self, result: SQLResult) -> tuple:
+        """Like _fetch_capped_table, for a result of the sql_engine."""
+        batches = []
+        num_rows = 0
+        num_bytes = 0
+        truncated = False
+        async for batch in result.batches():
+            keep, num_bytes = self._get_rows_to_keep(batch, num_rows, num_bytes)
+            if keep > 0:
+                batches.append(batch.slice(0, keep))
+                num_rows += keep
+            if keep < batch.num_rows:
+                truncated = True
+                break
+            # skip downloading a partition only to learn that it is cut off
+            if num_rows == self.max_rows and (result.num_rows or 0) > num_rows:
+                truncated = True
+                break
+
+        return self._combine_capped_batches(batches, truncated, result.num_rows)
+
+    def _get_rows_to_keep(self, batch: pa.Table, num_rows: int, num_bytes: int):
+        keep = batch.num_rows
+        if self.max_rows is not None:
+            keep = min(keep, self.max_rows - num_rows)
+        if self.max_bytes is not None and batch.num_rows:
+            row_bytes = batch.nbytes / batch.num_rows
+            keep = min(keep, int((self.max_bytes - num_bytes) // row_bytes))
+            if num_rows == 0:
+                keep = max(keep, 1)
+            num_bytes += int(keep * row_bytes)
+        return keep, num_bytes
+
+    def _combine_capped_batches(
+        self, batches: List[pa.Table], truncated: bool, total_rows: Optional[int]
+    ) -> tuple:
+        if not batches:
+            return None, ""
+
+        table = pa.concat_tables(batches)
+        if not truncated:
+            return table, ""
+
+        num_rows = table.num_rows
+        total = f"{total_rows}" if total_rows is not None else "more"
+        gateway_logger.log(
+            "DEBUG", f"Cortex Analyst result truncated to {num_rows} of {total} rows"
+        )
+        return (
+            table,
+            f"\nNote: the result was truncated to the first {num_rows} of {total} rows.",
+        )
+
     def _prepare_analyst_description(
         self, name: str, service_topic: str, data_source_description: str
     ) -> str:
@@ -388,7 +1152,7 @@ class PythonTool(Tool):
             loop = asyncio.get_running_loop()
             _func = partial(sync_func, *args, **kwargs)
             result = await loop.run_in_executor(None, _func)
-            return {
+            response = {
                 "output": result,
                 "sources": {
                     "tool_type": "custom_tool",
@@ -396,6 +1160,9 @@ class PythonTool(Tool):
                     "metadata": [{"python_tool": f"{sync_func.__name__} tool"}],
                 },
             }
+            if get_table_type(type(result)) is not None:
+                response["data"] = result
+            return response
 
         return async_func
 
@@ -411,13 +1178,23 @@ class PythonTool(Tool):
         return name + signature
 
     def _create_args_schema(self, func) -> Type[BaseModel]:
-        """Generate a Pydantic schema from the function's signature."""
+        """Generate a Pydantic schema from the function's signature.
+
+        Arguments annotated as pa.Table or pd.DataFrame also accept a string, the
+        rendered output of a task that has no structured data to pass on.
+        """
         params = signature(func).parameters
-        fields = {
-            name: (param.annotation if param.annotation != param.empty else Any, ...)
-            for name, param in params.items()
-        }
-        return create_model(f"{func.__name__}ArgsSchema", **fields)
+        fields = {}
+        for name, param in params.items():
+            annotation = param.annotation if param.annotation != param.empty else Any
+            if get_table_type(annotation) is not None:
+                annotation = Union[annotation, str]
+            fields[name] = (annotation, ...)
+        return create_model(
+            f"{func.__name__}ArgsSchema",
+            __config__=ConfigDict(arbitrary_types_allowed=True),
+            **fields,
+        )
 
 
 class SQLTool(Tool):
@@ -425,17 +1202,47 @@ class SQLTool(Tool):
         self,
         name: str,
         sql_query: str,
-        connection: Union[Session, SnowflakeConnection],
+        connection: Union[Session, SnowflakeConnection, SnowflakeConnectionPool],
         tool_description: str,
         output_description: str,
+        cache_ttl: Optional[float] = None,
+        max_staleness: float = 0.0,
+        invalidation_probe: Optional[str] = None,
+        result_reuse_window: Optional[float] = None,
+        sql_engine: Optional[SQLEngine] = None,
     ) -> None:
+        """Initialize SQLTool with parameters.
+
+        Set cache_ttl to reuse the result of sql_query for that many seconds.
+        For max_staleness seconds after it expires, the cached result is still
+        returned while it is refreshed in the background. invalidation_probe is
+        an optional cheap query (e.g. the LAST_ALTERED of the source tables)
+        whose result must change for an expired result to be queried again.
+        With result_reuse_window, the persisted result of a run in the last
+        result_reuse_window seconds is fetched instead of running the query.
+        sql_engine runs sql_query instead of the Python connector.
+        """
         self.connection = _get_connection(connection)
+        self.connection_pool = _get_connection_pool(connection)
         self.sql_query = sql_query
         self.name = name
         self.desc = self._generate_description(
             tool_description=tool_description,
             output_description=output_description,
         )
+        self.cache_ttl = cache_ttl
+        self.max_staleness = max_staleness
+        self.invalidation_probe = invalidation_probe
+        self.result_registry = (
+            QueryResultRegistry(result_reuse_window) if result_reuse_window else None
+        )
+        self.sql_engine = sql_engine
+        self._cached_table = None
+        self._cached_at: Optional[float] = None
+        self._probe_value = None
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._pending_refresh: Optional[Future] = None
         super().__init__(name=self.name, func=self.query, description=self.desc)
         gateway_logger.log("INFO", "SQL Tool successfully initialized")
 
@@ -446,11 +1253,19 @@ class SQLTool(Tool):
         return await self._run_query()
 
     async def _run_query(self):
-        gateway_logger.log("DEBUG", f"Running SQL Query: {self.sql_query}")
-        table = self.connection.cursor().execute(self.sql_query).fetch_pandas_all()
+        if self.cache_ttl is None and self.sql_engine is not None:
+            table = await self._afetch_table()
+        elif self.cache_ttl is None:
+            table = await asyncio.get_running_loop().run_in_executor(
+                None, self._fetch_table, get_statement_timeout()
+            )
+        else:
+            table = await self._get_cached_table()
+
         gateway_logger.log("DEBUG", f"SQL Tool Response: {table}")
         return {
             "output": table,
+            "data": table,
             "sources": {
                 "tool_type": "SQL",
                 "tool_name": self.name,
@@ -458,6 +1273,131 @@ class SQLTool(Tool):
             },
         }
 
+    def _fetch_table(self, timeout: Optional[int] = None):
+        gateway_logger.log("DEBUG", f"Running SQL Query: {self.sql_query}")
+        with borrow_connection(self.connection, self.connection_pool) as connection:
+            return execute_query(
+                connection,
+                self.sql_query,
+                timeout=timeout,
+                result_registry=self.result_registry,
+            ).fetch_pandas_all()
+
+    async def _afetch_table(self):
+        gateway_logger.log("DEBUG", f"Running SQL Query: {self.sql_query}")
+        result = await self.sql_engine.execute(self.sql_query)
+        return await result.to_pandas()
+
+    async def _get_cached_table(self):
+        age = None if self._cached_at is None else time.monotonic() - self._cached_at
+        if age is not None and age < self.cache_ttl:
+            gateway_logger.log("DEBUG", f"SQL Tool {self.name} cache hit")
+            return self._cached_table.copy()
+
+        if age is not None and age < self.cache_ttl + self.max_staleness:
+            gateway_logger.log("DEBUG", f"SQL Tool {self.name} serving stale result")
+            self._refresh_in_background()
+            return self._cached_table.copy()
+
+        await self._refresh_once()
+        return self._cached_table.copy()
+
+    async def _refresh_once(self) -> None:
+        """Refreshes the cached result, or waits for the refresh in progress."""
+        with self._refresh_lock:
+            pending = self._pending_refresh
+            if pending is None:
+                self._pending_refresh = Future()
+        if pending is not None:
+            # shielded, so that a cancelled caller does not cancel the refresh
+            await asyncio.shield(asyncio.wrap_future(pending))
+            return
+
+        pending = self._pending_refresh
+        try:
+            if self.sql_engine is not None:
+                await self._arefresh()
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._refresh, get_statement_timeout()
+                )
+            pending.set_result(None)
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._refresh_lock:
+                self._pending_refresh = None
+
+    def _refresh_in_background(self) -> None:
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                if self.sql_engine is not None:
+                    # the loop of the request may be closed before the refresh
+                    # completes, e.g. by a sync Agent call, so it gets its own
+                    asyncio.run(self._arefresh_in_background())
+                else:
+                    self._refresh()
+            except Exception as e:
+                gateway_logger.log(
+                    "WARNING", f"Background refresh of {self.name} failed: {str(e)}"
+                )
+            finally:
+                self._refreshing = False
+
+        threading.Thread(
+            target=refresh, name=f"{self.name}-refresh", daemon=True
+        ).start()
+
+    async def _arefresh_in_background(self) -> None:
+        try:
+            await self._arefresh()
+        finally:
+            await self.sql_engine.aclose()
+
+    def _refresh(self, timeout: Optional[int] = None) -> None:
+        """Re-runs sql_query unless the invalidation probe reports no change."""
+        probe_value = None
+        if self.invalidation_probe is not None:
+            with borrow_connection(self.connection, self.connection_pool) as connection:
+                probe_value = (
+                    connection.cursor()
+                    .execute(self.invalidation_probe, timeout=timeout)
+                    .fetchall()
+                )
+            if self._cached_at is not None and probe_value == self._probe_value:
+                gateway_logger.log("DEBUG", f"SQL Tool {self.name} source unchanged")
+                self._cached_at = time.monotonic()
+                return
+
+        self._cached_table = self._fetch_table(timeout)
+        self._probe_value = probe_value
+        self._cached_at = time.monotonic()
+
+    async def _arefresh(self) -> None:
+        """Like _refresh, running both queries on the sql_engine."""
+        probe_value = None
+        if self.invalidation_probe is not None:
+            probe = await self.sql_engine.execute(self.invalidation_probe)
+            table = await probe.to_arrow()
+            probe_value = [
+                tuple(row.values())
+                for row in (table.to_pylist() if table is not None else [])
+            ]
+            if self._cached_at is not None and probe_value == self._probe_value:
+                gateway_logger.log("DEBUG", f"SQL Tool {self.name} source unchanged")
+                self._cached_at = time.monotonic()
+                return
+
+        self._cached_table = await self._afetch_table()
+        self._probe_value = probe_value
+        self._cached_at = time.monotonic()
+
     def _generate_description(
         self,
         tool_description: str,
@@ -0,0 +1,330 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import annotations
+
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+from decimal import ROUND_FLOOR, Decimal
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+import aiohttp
+import pyarrow as pa
+from snowflake.connector.connection import SnowflakeConnection
+from snowflake.snowpark import Session
+
+from agent_gateway.tools.logger import gateway_logger
+from agent_gateway.tools.utils import (
+    SQL_POLL_INTERVAL,
+    CortexEndpointBuilder,
+    DeadlineExceededError,
+    HTTPSessionPool,
+    QueryResultRegistry,
+    SnowflakeConnectionPool,
+    _abort_query,
+    _check_deadline,
+    _determine_runtime,
+    _get_connection,
+    _get_connection_pool,
+    _get_request_timeout,
+    execute_query_async,
+    get_remaining_time,
+    get_statement_timeout,
+    set_request_deadline,
+)
+
+
+class SQLExecutionError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+        gateway_logger.log("ERROR", message)
+        super().__init__(self.message)
+
+
+class SQLResult(ABC):
+    """Result of a SQL statement, fetched one Arrow batch at a time."""
+
+    query_id: Optional[str] = None
+    num_rows: Optional[int] = None
+
+    @abstractmethod
+    def batches(self) -> AsyncIterator[pa.Table]:
+        pass
+
+    async def to_arrow(self) -> Optional[pa.Table]:
+        """Fetches all batches into one table, or None if there are no rows."""
+        batches = [batch async for batch in self.batches()]
+        return pa.concat_tables(batches) if batches else None
+
+    async def to_pandas(self):
+        table = await self.to_arrow()
+        return (table if table is not None else pa.table({})).to_pandas()
+
+
+class SQLEngine(ABC):
+    """Executes the SQL statements of the Snowflake tools."""
+
+    @abstractmethod
+    async def execute(self, sql: str) -> SQLResult:
+        """Runs a statement until it completes and returns its result."""
+
+    @abstractmethod
+    async def cancel(self, query_id: str) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        """Releases what the engine holds for the running event loop."""
+
+
+class _ConnectorResult(SQLResult):
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.query_id = cursor.sfqid
+        self.num_rows = cursor.rowcount
+
+    async def batches(self) -> AsyncIterator[pa.Table]:
+        loop = asyncio.get_running_loop()
+        iterator = await loop.run_in_executor(None, self.cursor.fetch_arrow_batches)
+        while (
+            batch := await loop.run_in_executor(None, next, iterator, None)
+        ) is not None:
+            yield batch
+
+
+class ConnectorSQLEngine(SQLEngine):
+    """SQL engine running statements through the Snowflake Python connector.
+
+    Statements are submitted asynchronously and polled from a thread pool, see
+    execute_query_async.
+    """
+
+    def __init__(
+        self,
+        connection: Union[Session, SnowflakeConnection],
+        poll_interval: float = SQL_POLL_INTERVAL,
+        result_registry: Optional[QueryResultRegistry] = None,
+    ) -> None:
+        self.connection = _get_connection(connection)
+        self.poll_interval = poll_interval
+        self.result_registry = result_registry
+
+    async def execute(self, sql: str) -> SQLResult:
+        cursor = await execute_query_async(
+            self.connection,
+            sql,
+            poll_interval=self.poll_interval,
+            result_registry=self.result_registry,
+        )
+        return _ConnectorResult(cursor)
+
+    async def cancel(self, query_id: str) -> None:
+        cursor = self.connection.cursor()
+        await asyncio.get_running_loop().run_in_executor(
+            None, _abort_query, cursor, query_id
+        )
+
+
+def _parse_timestamp(value: str) -> datetime:
+    # TIMESTAMP_TZ values carry their offset after the epoch seconds
+    seconds, _, _ = value.partition(" ")
+    micros = (Decimal(seconds) * 1000000).to_integral_value(rounding=ROUND_FLOOR)
+    return datetime(1970, 1, 1) + timedelta(microseconds=int(micros))
+
+
+def _column_converter(column: Dict[str, Any]) -> tuple:
+    """Returns the Arrow type of a SQL API column and a converter of its values."""
+    column_type = column["type"].lower()
+    if column_type == "fixed":
+        scale = column.get("scale") or 0
+        precision = column.get("precision") or 38
+        # int64 holds every NUMBER(18, 0), wider integers need a decimal
+        if scale == 0 and precision <= 18:
+            return pa.int64(), int
+        return pa.decimal128(precision, scale), Decimal
+    if column_type == "real":
+        return pa.float64(), float
+    if column_type == "boolean":
+        return pa.bool_(), lambda value: value.lower() in ("true", "1")
+    if column_type == "date":
+        return pa.date32(), lambda value: date(1970, 1, 1) + timedelta(int(value))
+    if column_type.startswith("timestamp"):
+        return pa.timestamp("us"), _parse_timestamp
+    return pa.string(), str
+
+
+class _SQLAPIResult(SQLResult):
+    def __init__(self, engine: SQLAPIEngine, response: Dict[str, Any]):
+        self.engine = engine
+        self.response = response
+        self.query_id = response.get("statementHandle")
+        metadata = response.get("resultSetMetaData", {})
+        self.num_rows = metadata.get("numRows")
+        self.columns = metadata.get("rowType", [])
+        self.num_partitions = max(len(metadata.get("partitionInfo", [])), 1)
+
+    def _to_arrow(self, rows: List[List[Optional[str]]]) -> pa.Table:
+        arrays = {}
+        for i, column in enumerate(self.columns):
+            arrow_type, convert = _column_converter(column)
+            arrays[column["name"]] = pa.array(
+                [None if row[i] is None else convert(row[i]) for row in rows],
+                type=arrow_type,
+            )
+        return pa.table(arrays)
+
+    async def batches(self) -> AsyncIterator[pa.Table]:
+        for partition in range(self.num_partitions):
+            if partition == 0:
+                rows = self.response.get("data") or []
+            else:
+                data = await self.engine._get_partition(self.query_id, partition)
+                rows = data.get("data") or []
+            # the first partition is kept even when empty, for its schema
+            if rows or partition == 0:
+                yield self._to_arrow(rows)
+
+
+class SQLAPIEngine(SQLEngine):
+    """SQL engine using the Snowflake SQL REST API (/api/v2/statements).
+
+    Statements are submitted asynchronously over the HTTPSessionPool shared with
+    the Cortex calls, polled without any thread hops, and their result partitions
+    are downloaded one at a time as they are consumed. A statement is cancelled
+    if the request deadline passes or the calling task is cancelled. The SQL API
+    is not available inside Snowflake, where the ConnectorSQLEngine is used.
+    """
+
+    def __init__(
+        self,
+        connection: Union[Session, SnowflakeConnection, SnowflakeConnectionPool],
+        http_pool: Optional[HTTPSessionPool] = None,
+        poll_interval: float = SQL_POLL_INTERVAL,
+    ) -> None:
+        if _determine_runtime():
+            raise SQLExecutionError(
+                message="The Snowflake SQL API is not available inside Snowflake"
+            )
+        self.connection = _get_connection(connection)
+        self.connection_pool = _get_connection_pool(connection)
+        self.http_pool = http_pool
+        self.poll_interval = poll_interval
+
+    async def _request(
+        self, method: str, url: str, data: Optional[dict] = None
+    ) -> tuple[int, Dict[str, Any]]:
+        try:
+            return await self._send(method, url, data)
+        except asyncio.TimeoutError as e:
+            # the request timeout is capped at the time left before the deadline
+            if get_remaining_time() == 0:
+                raise DeadlineExceededError("Request deadline exceeded") from e
+            raise
+
+    async def _send(
+        self, method: str, url: str, data: Optional[dict] = None
+    ) -> tuple[int, Dict[str, Any]]:
+        eb = CortexEndpointBuilder(self.connection_pool or self.connection)
+        headers = eb.get_sql_api_headers()
+        timeout = _get_request_timeout(None, self.http_pool)
+        request_kwargs = {}
+        if timeout is not None:
+            request_kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        if self.http_pool is not None:
+            session = self.http_pool.get_session()
+            async with session.request(
+                method, url, headers=headers, json=data, **request_kwargs
+            ) as response:
+                return response.status, await response.json(content_type=None)
+        async with aiohttp.ClientSession() as session:
+            async with session.request(
+                method, url, headers=headers, json=data, **request_kwargs
+            ) as response:
+                return response.status, await response.json(content_type=None)
+
+    def _statement_body(self, sql: str) -> Dict[str, Any]:
+        body = {"statement": sql}
+        statement_timeout = get_statement_timeout()
+        if statement_timeout is not None:
+            body["timeout"] = statement_timeout
+        connection = _get_connection(self.connection_pool or self.connection)
+        for key in ("database", "schema", "warehouse", "role"):
+            value = getattr(connection, key, None)
+            if value:
+                body[key] = value
+        return body
+
+    def _check_response(self, status: int, response: Dict[str, Any]) -> None:
+        if status >= 400:
+            raise SQLExecutionError(
+                message=f"SQL API request failed with status {status}: "
+                f"{response.get('message', 'Unknown error')}"
+            )
+
+    async def execute(self, sql: str) -> SQLResult:
+        eb = CortexEndpointBuilder(self.connection_pool or self.connection)
+        status, response = await self._request(
+            "POST",
+            eb.get_statements_endpoint(params={"async": "true"}),
+            self._statement_body(sql),
+        )
+        self._check_response(status, response)
+        handle = response.get("statementHandle")
+
+        completed = False
+        try:
+            while status == 202:
+                remaining = _check_deadline()
+                await asyncio.sleep(
+                    self.poll_interval
+                    if remaining is None
+                    else min(self.poll_interval, remaining)
+                )
+                status, response = await self._request(
+                    "GET", eb.get_statements_endpoint(handle)
+                )
+                self._check_response(status, response)
+            completed = True
+        finally:
+            if not completed and handle is not None:
+                asyncio.ensure_future(self._cancel_quietly(handle))
+
+        return _SQLAPIResult(self, response)
+
+    async def _get_partition(self, handle: str, partition: int) -> Dict[str, Any]:
+        eb = CortexEndpointBuilder(self.connection_pool or self.connection)
+        status, response = await self._request(
+            "GET",
+            eb.get_statements_endpoint(handle, params={"partition": str(partition)}),
+        )
+        self._check_response(status, response)
+        return response
+
+    async def cancel(self, query_id: str) -> None:
+        eb = CortexEndpointBuilder(self.connection_pool or self.connection)
+        status, response = await self._request(
+            "POST", eb.get_statements_endpoint(query_id, action="cancel")
+        )
+        self._check_response(status, response)
+
+    async def aclose(self) -> None:
+        if self.http_pool is not None:
+            await self.http_pool.aclose()
+
+    async def _cancel_quietly(self, query_id: str) -> None:
+        # runs in its own task, so the expired deadline is only cleared here
+        set_request_deadline(None)
+        try:
+            await self.cancel(query_id)
+        except Exception as e:
+            gateway_logger.log("WARNING", f"Unable to cancel {query_id}: {str(e)}")
@@ -12,28 +12,64 @@
 from __future__ import annotations
 
 import asyncio
+import codecs
 import io
 import json
-from collections import deque
+import math
+import re
+import threading
+import time
+import types
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, Token
+from decimal import Decimal
+from functools import partial
 from textwrap import dedent
-from typing import TypedDict, Union
-from urllib.parse import urlunparse
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    TypedDict,
+    Union,
+    get_args,
+    get_origin,
+)
+from urllib.parse import urlencode, urlunparse
 import importlib
 
 import aiohttp
+import pyarrow as pa
+import pyarrow.compute as pc
 import pkg_resources
 from snowflake.connector.connection import SnowflakeConnection
 from snowflake.snowpark import Session
 
 
 def _get_connection(
-    connection: Union[Session, SnowflakeConnection],
+    connection: Union[Session, SnowflakeConnection, SnowflakeConnectionPool],
 ) -> SnowflakeConnection:
     if isinstance(connection, Session):
         return getattr(connection, "connection")
+    if isinstance(connection, SnowflakeConnectionPool):
+        return connection.connection
     return connection
 
 
+def _get_connection_pool(
+    connection: Union[Session, SnowflakeConnection, SnowflakeConnectionPool],
+) -> Optional[SnowflakeConnectionPool]:
+    if isinstance(connection, SnowflakeConnectionPool):
+        return connection
+    return None
+
+
 class Headers(TypedDict):
     Accept: str
     Content_Type: str
@@ -49,6 +85,50 @@ def _determine_runtime():
         return False
 
 
+_request_deadline: ContextVar[Optional[float]] = ContextVar(
+    "request_deadline", default=None
+)
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when work is started after the request deadline has passed."""
+
+
+def set_request_deadline(timeout: Optional[float]) -> Token:
+    """Set the time budget, in seconds, of the current request context.
+
+    Tasks created afterwards inherit the deadline, so every planner, tool, HTTP
+    and SQL call made on behalf of the request only uses the remaining budget.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    return _request_deadline.set(deadline)
+
+
+def reset_request_deadline(token: Token) -> None:
+    _request_deadline.reset(token)
+
+
+def get_remaining_time() -> Optional[float]:
+    """Seconds left before the request deadline, or None without a deadline."""
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def _check_deadline() -> Optional[float]:
+    remaining = get_remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError("Request deadline exceeded")
+    return remaining
+
+
+def get_statement_timeout() -> Optional[int]:
+    """Timeout in whole seconds for a SQL statement run within the deadline."""
+    remaining = _check_deadline()
+    return math.ceil(remaining) if remaining is not None else None
+
+
 def _should_instrument():
     required_packages = ["trulens", "trulens.connectors.snowflake"]
     return all(
@@ -101,6 +181,23 @@ class CortexEndpointBuilder:
             return URL_SUFFIX
         return f"{self.BASE_URL}{URL_SUFFIX}"
 
+    def get_statements_endpoint(
+        self,
+        statement_handle: Optional[str] = None,
+        action: Optional[str] = None,
+        params: Optional[Dict[str, str]] = None,
+    ):
+        URL_SUFFIX = "/api/v2/statements"
+        if statement_handle is not None:
+            URL_SUFFIX += f"/{statement_handle}"
+        if action is not None:
+            URL_SUFFIX += f"/{action}"
+        if params:
+            URL_SUFFIX += f"?{urlencode(params)}"
+        if self.inside_snowflake:
+            return URL_SUFFIX
+        return f"{self.BASE_URL}{URL_SUFFIX}"
+
     def get_complete_headers(self) -> Headers:
         return self.BASE_HEADERS | {"Accept": "application/json"}
 
@@ -110,30 +207,967 @@ class CortexEndpointBuilder:
     def get_search_headers(self) -> Headers:
         return self.BASE_HEADERS | {"Accept": "application/json"}
 
+    def get_sql_api_headers(self) -> Headers:
+        return self.BASE_HEADERS | {"Accept": "application/json"}
 
-async def post_cortex_request(url: str, headers: Headers, data: dict):
-    """Submit cortex request depending on runtime"""
 
-    if _determine_runtime():
-        import _snowflake
+RUNTIME_REQUEST_TIMEOUT = 30.0  # seconds
+RUNTIME_MAX_WORKERS = 10
+
+_runtime_executor: Optional[ThreadPoolExecutor] = None
+_runtime_executor_lock = threading.Lock()
+
+
+def _get_default_runtime_executor() -> ThreadPoolExecutor:
+    global _runtime_executor
+    with _runtime_executor_lock:
+        if _runtime_executor is None:
+            _runtime_executor = ThreadPoolExecutor(
+                max_workers=RUNTIME_MAX_WORKERS, thread_name_prefix="cortex-runtime"
+            )
+    return _runtime_executor
+
+
+class HTTPSessionPool:
+    """Shared aiohttp connection pool used for all Cortex REST calls.
+
+    Keeps TCP/TLS connections alive between the planner, fuse, summarize, search
+    and analyst requests instead of opening a new session for each of them.
+    aiohttp sessions are bound to an event loop, so one session is lazily opened
+    per running loop. Inside Snowflake, where requests go through the blocking
+    _snowflake API, the pool instead provides a bounded thread pool so that
+    requests do not block the event loop.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        keepalive_timeout: float = 30.0,
+        request_timeout: Optional[float] = None,
+    ) -> None:
+        """Parameters
+
+        ----------
+
+        Args:
+            limit: Maximum number of open connections across all hosts.
+            limit_per_host: Maximum number of open connections to a single host.
+                Also bounds the number of concurrent requests inside Snowflake.
+            keepalive_timeout: Seconds an idle connection is kept open for reuse.
+            request_timeout: Timeout in seconds of each request. Defaults to the
+                aiohttp default, or RUNTIME_REQUEST_TIMEOUT inside Snowflake.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.limit_per_host,
+                    thread_name_prefix="cortex-runtime",
+                )
+        return self._executor
+
+    def get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.get(loop)
+            if session is None or session.closed:
+                # Sessions of loops that were closed without aclose() are unusable
+                self._sessions = {
+                    lp: s for lp, s in self._sessions.items() if not lp.is_closed()
+                }
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+                session = aiohttp.ClientSession(connector=connector)
+                self._sessions[loop] = session
+        return session
+
+    async def aclose(self) -> None:
+        """Close the session bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.pop(loop, None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    def close(self) -> None:
+        """Shut down the thread pool of the requests made inside Snowflake."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> HTTPSessionPool:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+class ConnectionPoolTimeoutError(TimeoutError):
+    """Raised when no pooled Snowflake connection becomes available in time."""
+
+
+class SnowflakeConnectionPool:
+    """Pool of Snowflake connections that tools borrow for each query.
+
+    Cursors of one connection serialize in the connector, so tools sharing a
+    single connection cannot run their queries concurrently. The pool hands out
+    a separate connection to each query instead. It is seeded from an
+    authenticated Session or connection: unless connection_params or a
+    connection_factory are given, new connections attach to the seed's session
+    with its tokens, so no additional login is needed. The seed is pooled as
+    well, but it is never closed by the pool.
+    """
+
+    def __init__(
+        self,
+        connection: Union[Session, SnowflakeConnection],
+        min_size: int = 1,
+        max_size: int = 8,
+        idle_timeout: Optional[float] = 600.0,
+        health_check_interval: Optional[float] = 60.0,
+        acquire_timeout: Optional[float] = 30.0,
+        connection_params: Optional[Dict[str, Any]] = None,
+        connection_factory: Optional[
+            Callable[[], Union[Session, SnowflakeConnection]]
+        ] = None,
+    ) -> None:
+        """Parameters
+
+        ----------
+
+        Args:
+            connection: Authenticated Session or connection the pool is seeded from.
+            min_size: Number of connections opened upfront and kept when idle.
+            max_size: Maximum number of open connections, including the seed.
+            idle_timeout: Seconds after which an idle connection above min_size
+                is closed. None keeps idle connections open.
+            health_check_interval: A connection idle for longer than this is
+                validated with a heartbeat before it is handed out. None disables
+                the health check.
+            acquire_timeout: Seconds to wait for a free connection when max_size
+                connections are in use. None waits indefinitely.
+            connection_params: Keyword arguments of snowflake.connector.connect
+                used to open new connections, each with its own login.
+            connection_factory: Callable returning a new Session or connection.
+                Takes precedence over connection_params.
+        """
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("the pool needs 1 <= max_size and min_size <= max_size")
+        self.connection = _get_connection(connection)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.connection_params = connection_params
+        self.connection_factory = connection_factory
+        self._seed = self.connection
+        self._open: List[SnowflakeConnection] = [self.connection]
+        self._idle: deque = deque([(self.connection, time.monotonic())])
+        self._opening = 0
+        self._replacements: Dict[int, SnowflakeConnection] = {}
+        self._condition = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+        for _ in range(min_size - 1):
+            connection = self._create_connection()
+            self._open.append(connection)
+            self._idle.append((connection, time.monotonic()))
+
+    @property
+    def size(self) -> int:
+        """Number of open connections, idle or borrowed."""
+        return len(self._open) + self._opening
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    @property
+    def shares_session(self) -> bool:
+        """Whether new connections attach to the session of the seed."""
+        return self.connection_factory is None and self.connection_params is None
+
+    def connections(self) -> List[SnowflakeConnection]:
+        """Snapshot of the open connections, idle or borrowed."""
+        with self._condition:
+            return list(self._open)
+
+    def create_connection(self) -> SnowflakeConnection:
+        """Opens a new connection outside of the pool, e.g. to replace one."""
+        return self._create_connection()
+
+    def _create_connection(self) -> SnowflakeConnection:
+        if self.connection_factory is not None:
+            return _get_connection(self.connection_factory())
+
+        import snowflake.connector
+
+        if self.connection_params is not None:
+            return snowflake.connector.connect(**self.connection_params)
+
+        seed = self.connection
+        return snowflake.connector.connect(
+            account=seed.account,
+            user=seed.user,
+            host=seed.host,
+            port=seed.port,
+            protocol=getattr(seed, "scheme", "https"),
+            database=seed.database,
+            schema=seed.schema,
+            warehouse=seed.warehouse,
+            role=seed.role,
+            session_token=seed.rest.token,
+            master_token=seed.rest.master_token,
+            # closing a pooled connection must not log out the shared session
+            server_session_keep_alive=True,
+        )
+
+    def _close_connection(self, connection: SnowflakeConnection) -> None:
+        if connection is self._seed or connection is self.connection:
+            return
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, connection: SnowflakeConnection, last_used: float) -> bool:
+        if connection.is_closed():
+            return False
+        if (
+            self.health_check_interval is None
+            or time.monotonic() - last_used < self.health_check_interval
+        ):
+            return True
+        return connection.is_valid()
+
+    def _remove(self, connection: SnowflakeConnection) -> None:
+        if connection in self._open:
+            self._open.remove(connection)
+
+    def _prune_idle(self) -> List[SnowflakeConnection]:
+        """Removes idle connections above min_size that exceeded idle_timeout."""
+        if self.idle_timeout is None:
+            return []
+        expired = []
+        now = time.monotonic()
+        for entry in list(self._idle):
+            if self.size <= self.min_size:
+                break
+            connection, last_used = entry
+            if (
+                connection is not self.connection
+                and now - last_used > self.idle_timeout
+            ):
+                self._idle.remove(entry)
+                self._remove(connection)
+                expired.append(connection)
+        return expired
+
+    def acquire(self, timeout: Optional[float] = None) -> SnowflakeConnection:
+        """Borrows a healthy connection, opening one if none is idle.
+
+        Waits up to timeout seconds (acquire_timeout by default) for a borrowed
+        connection to be released once max_size connections are open.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                while not self._idle and self.size >= self.max_size:
+                    if self._closed:
+                        raise RuntimeError("the connection pool is closed")
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        raise ConnectionPoolTimeoutError(
+                            f"no Snowflake connection available after {timeout}s"
+                        )
+                    self._condition.wait(remaining)
+                if self._closed:
+                    raise RuntimeError("the connection pool is closed")
+                # prefer the most recently used connection, so idle ones expire
+                entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    self._opening += 1
+
+            if entry is None:
+                try:
+                    connection = self._create_connection()
+                except Exception:
+                    with self._condition:
+                        self._opening -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._opening -= 1
+                    self._open.append(connection)
+                return connection
+
+            connection, last_used = entry
+            if self._is_healthy(connection, last_used):
+                return connection
+            self._discard(connection)
+
+    async def aacquire(self, timeout: Optional[float] = None) -> SnowflakeConnection:
+        """Like acquire, without blocking the event loop.
+
+        The wait runs on a thread pool of the connection pool, sized to
+        max_size, so that waiting for a free connection never holds the threads
+        of the default executor that the queries themselves run on.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def acquire() -> SnowflakeConnection:
+            # the timeout also covers the time spent queued for a thread
+            if deadline is None:
+                return self.acquire()
+            return self.acquire(max(deadline - time.monotonic(), 0.0))
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), acquire
+        )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # hand back the connection acquired for a cancelled borrower
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() or self.release(f.result())
+            )
+            raise
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._condition:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_size, thread_name_prefix="snowflake-pool"
+                )
+            return self._executor
+
+    def release(self, connection: SnowflakeConnection) -> None:
+        """Returns a borrowed connection to the pool."""
+        with self._condition:
+            replacement = self._replacements.pop(id(connection), None)
+        if replacement is not None:
+            self._close_connection(connection)
+            connection = replacement
+        if connection.is_closed():
+            self._discard(connection)
+            return
+        with self._condition:
+            if self._closed:
+                self._remove(connection)
+                expired = [connection]
+            else:
+                self._idle.append((connection, time.monotonic()))
+                expired = self._prune_idle()
+            self._condition.notify()
+        for expired_connection in expired:
+            self._close_connection(expired_connection)
+
+    def replace(
+        self, connection: SnowflakeConnection, replacement: SnowflakeConnection
+    ) -> None:
+        """Atomically swaps a pooled connection for a new one.
+
+        An idle connection is swapped and closed right away. A borrowed one is
+        kept by its borrower and swapped when it is released.
+        """
+        with self._condition:
+            if connection not in self._open or self._closed:
+                swapped = False
+            else:
+                swapped = True
+                self._open[self._open.index(connection)] = replacement
+                if connection is self.connection:
+                    self.connection = replacement
+                for i, (idle_connection, _) in enumerate(self._idle):
+                    if idle_connection is connection:
+                        self._idle[i] = (replacement, time.monotonic())
+                        break
+                else:
+                    self._replacements[id(connection)] = replacement
+                    return
+        self._close_connection(connection if swapped else replacement)
+
+    def _discard(self, connection: SnowflakeConnection) -> None:
+        with self._condition:
+            self._remove(connection)
+            self._condition.notify()
+        self._close_connection(connection)
+
+    @contextmanager
+    def borrow(self) -> Iterator[SnowflakeConnection]:
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """Closes the idle connections; borrowed ones are closed on release."""
+        with self._condition:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            for connection in idle:
+                self._remove(connection)
+            self._condition.notify_all()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for connection in idle:
+            self._close_connection(connection)
+
+    def __enter__(self) -> SnowflakeConnectionPool:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+@contextmanager
+def borrow_connection(
+    connection: SnowflakeConnection, pool: Optional[SnowflakeConnectionPool]
+) -> Iterator[SnowflakeConnection]:
+    """Borrows a connection from pool, or uses connection without a pool."""
+    if pool is None:
+        yield connection
+    else:
+        with pool.borrow() as pooled_connection:
+            yield pooled_connection
+
+
+@asynccontextmanager
+async def aborrow_connection(
+    connection: SnowflakeConnection, pool: Optional[SnowflakeConnectionPool]
+) -> AsyncIterator[SnowflakeConnection]:
+    """Like borrow_connection, waiting for a free connection off the event loop."""
+    if pool is None:
+        yield connection
+        return
+    pooled_connection = await pool.aacquire()
+    try:
+        yield pooled_connection
+    finally:
+        pool.release(pooled_connection)
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after a TTL.
+
+    Used to memoize tool results that are repeatedly requested by the planner.
+    Entries are evicted in least-recently-used order once maxsize is reached.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None) -> None:
+        """Parameters
+
+        ----------
+
+        Args:
+            maxsize: Maximum number of entries kept in the cache.
+            ttl: Default time to live of an entry in seconds. None never expires.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
 
-        resp = _snowflake.send_snow_api_request(
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (
+                entry[1] is None or entry[1] > time.monotonic()
+            )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CortexResponseError(Exception):
+    """Raised when a Cortex REST endpoint answers with an error status."""
+
+
+def _get_request_timeout(
+    timeout: Optional[float], http_pool: Optional[HTTPSessionPool]
+) -> Optional[float]:
+    if timeout is None and http_pool is not None:
+        timeout = http_pool.request_timeout
+    remaining = _check_deadline()
+    if remaining is not None and (timeout is None or remaining < timeout):
+        return remaining
+    return timeout
+
+
+@asynccontextmanager
+async def _cortex_post(
+    url: str,
+    headers: Headers,
+    data: dict,
+    http_pool: Optional[HTTPSessionPool] = None,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[aiohttp.ClientResponse]:
+    timeout = _get_request_timeout(timeout, http_pool)
+    request_kwargs = {}
+    if timeout is not None:
+        request_kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+    if http_pool is not None:
+        session = http_pool.get_session()
+        async with session.post(
+            url=url, headers=headers, json=data, **request_kwargs
+        ) as response:
+            yield response
+    else:
+        async with aiohttp.ClientSession(
+            headers=headers,
+        ) as session:
+            async with session.post(url=url, json=data, **request_kwargs) as response:
+                yield response
+
+
+async def _post_runtime_request(
+    url: str,
+    data: dict,
+    http_pool: Optional[HTTPSessionPool] = None,
+    timeout: Optional[float] = None,
+) -> str:
+    import _snowflake
+
+    timeout = _get_request_timeout(timeout, http_pool)
+    if timeout is None:
+        timeout = RUNTIME_REQUEST_TIMEOUT
+    executor = (
+        http_pool.get_executor()
+        if http_pool is not None
+        else _get_default_runtime_executor()
+    )
+
+    # send_snow_api_request blocks, so it runs on a bounded thread pool to let
+    # the other tasks of the plan proceed in the meantime
+    resp = await asyncio.get_running_loop().run_in_executor(
+        executor,
+        partial(
+            _snowflake.send_snow_api_request,
             "POST",
             url,
             {},
             {},
             data,
             {},
-            30000,
+            math.ceil(timeout * 1000),
+        ),
+    )
+
+    return json.dumps(resp)
+
+
+async def post_cortex_request(
+    url: str,
+    headers: Headers,
+    data: dict,
+    http_pool: Optional[HTTPSessionPool] = None,
+    timeout: Optional[float] = None,
+):
+    """Submit cortex request depending on runtime"""
+
+    if _determine_runtime():
+        return await _post_runtime_request(url, data, http_pool, timeout)
+    else:
+        async with _cortex_post(url, headers, data, http_pool, timeout) as response:
+            return await response.text()
+
+
+class SSEDecoder:
+    """Incremental decoder for the server-sent events returned by Cortex.
+
+    Bytes are fed as they arrive from the network and the payload of every
+    complete `data:` line is returned. Cortex emits one JSON document per data
+    line, so each payload can be parsed on its own.
+    """
+
+    def __init__(self) -> None:
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        self._buffer += self._decoder.decode(chunk)
+        if "\n" not in self._buffer:
+            return []
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse_lines(lines)
+
+    def flush(self) -> List[str]:
+        lines = [self._buffer + self._decoder.decode(b"", final=True)]
+        self._buffer = ""
+        return self._parse_lines(lines)
+
+    @staticmethod
+    def _parse_lines(lines: List[str]) -> List[str]:
+        payloads = []
+        for line in lines:
+            line = line.strip()
+            if line.startswith("data:"):
+                payload = line[5:].strip()
+                if payload and payload != "[DONE]":
+                    payloads.append(payload)
+        return payloads
+
+
+def _get_completion_delta(chunk: dict) -> str:
+    return chunk["choices"][0]["delta"].get("content", "")
+
+
+async def stream_cortex_request(
+    url: str,
+    headers: Headers,
+    data: dict,
+    http_pool: Optional[HTTPSessionPool] = None,
+) -> AsyncIterator[str]:
+    """Yield the completion deltas of a Cortex inference:complete request.
+
+    Outside of Snowflake the response body is decoded chunk by chunk, so
+    callers can act on the completion while the LLM is still generating it.
+    """
+
+    if _determine_runtime():
+        response_text = await _post_runtime_request(url, data, http_pool)
+        content = json.loads(response_text).get("content")
+        for event in json.loads(content):
+            delta = _get_completion_delta(event["data"])
+            if delta:
+                yield delta
+        return
+
+    async with _cortex_post(url, headers, data, http_pool) as response:
+        if response.status >= 400:
+            raise CortexResponseError(await response.text())
+
+        decoder = SSEDecoder()
+        async for chunk in response.content.iter_any():
+            for payload in decoder.feed(chunk):
+                delta = _get_completion_delta(json.loads(payload))
+                if delta:
+                    yield delta
+        for payload in decoder.flush():
+            delta = _get_completion_delta(json.loads(payload))
+            if delta:
+                yield delta
+
+
+SQL_POLL_INTERVAL = 0.1  # seconds
+
+
+def _normalize_sql(sql: str) -> str:
+    """Collapses whitespace outside of string literals and drops a trailing ;"""
+    parts = re.split(r"('(?:[^']|'')*')", sql.strip().rstrip(";").strip())
+    return "".join(
+        part if i % 2 else " ".join(part.split()) for i, part in enumerate(parts)
+    )
+
+
+# Snowflake persists query results for 24 hours
+RESULT_RETENTION = 24 * 3600.0
+
+
+class QueryResultRegistry:
+    """Remembers the query ID of recently executed SQL statements.
+
+    Snowflake keeps the result of a query for 24 hours, so a statement that was
+    executed recently by the same user and role can be answered from its
+    persisted result instead of running again on the warehouse.
+    """
+
+    def __init__(self, window: float, maxsize: int = 1024) -> None:
+        """Parameters
+
+        ----------
+
+        Args:
+            window: Seconds during which a persisted result is reused, at most
+                RESULT_RETENTION.
+            maxsize: Maximum number of statements remembered.
+        """
+        if window > RESULT_RETENTION:
+            raise ValueError(
+                f"result reuse window of {window}s exceeds the {RESULT_RETENTION:.0f}s "
+                "that Snowflake keeps query results"
+            )
+        self.window = window
+        self._query_ids = TTLCache(maxsize=maxsize, ttl=window)
+
+    @staticmethod
+    def _key(connection: SnowflakeConnection, sql: str) -> tuple:
+        return (
+            getattr(connection, "host", None),
+            getattr(connection, "user", None),
+            getattr(connection, "role", None),
+            getattr(connection, "database", None),
+            getattr(connection, "schema", None),
+            getattr(connection, "warehouse", None),
+            _normalize_sql(sql),
+        )
+
+    def get(self, connection: SnowflakeConnection, sql: str) -> Optional[str]:
+        return self._query_ids.get(self._key(connection, sql))
+
+    def record(self, connection: SnowflakeConnection, sql: str, query_id: str) -> None:
+        if query_id:
+            self._query_ids.set(self._key(connection, sql), query_id)
+
+    def invalidate(self, connection: SnowflakeConnection, sql: str) -> None:
+        self._query_ids.invalidate(self._key(connection, sql))
+
+
+def _reuse_result(
+    connection: SnowflakeConnection,
+    sql: str,
+    result_registry: Optional[QueryResultRegistry],
+):
+    """Returns a cursor on the persisted result of sql, or None if there is none."""
+    if result_registry is None:
+        return None
+    query_id = result_registry.get(connection, sql)
+    if query_id is None:
+        return None
+
+    cursor = connection.cursor()
+    try:
+        # get_results_from_sfqid only scans the result at the first fetch, so
+        # the scan runs here to fall back to the query if the result is gone
+        cursor.execute("SELECT * FROM TABLE(RESULT_SCAN(%s))", (query_id,))
+    except Exception:
+        # The persisted result expired or is not accessible, run the query again
+        result_registry.invalidate(connection, sql)
+        return None
+    return cursor
+
+
+def execute_query(
+    connection: SnowflakeConnection,
+    sql: str,
+    timeout: Optional[int] = None,
+    result_registry: Optional[QueryResultRegistry] = None,
+):
+    """Run a SQL statement, reusing a recent persisted result when possible."""
+    cursor = _reuse_result(connection, sql, result_registry)
+    if cursor is not None:
+        return cursor
+
+    cursor = connection.cursor()
+    cursor.execute(sql, timeout=timeout)
+    if result_registry is not None:
+        result_registry.record(connection, sql, cursor.sfqid)
+    return cursor
+
+
+def _abort_query(cursor, query_id: str) -> None:
+    try:
+        cursor.abort_query(query_id)
+    except Exception:
+        pass
+
+
+async def execute_query_async(
+    connection: SnowflakeConnection,
+    sql: str,
+    poll_interval: float = SQL_POLL_INTERVAL,
+    result_registry: Optional[QueryResultRegistry] = None,
+):
+    """Run a SQL statement without blocking the event loop.
+
+    The statement is submitted with execute_async and its status is polled until
+    it completes, so other tasks keep running while the warehouse works. Returns
+    a cursor whose results can be fetched. The statement is aborted if the
+    request deadline passes or the calling task is cancelled. With a
+    result_registry, a recent persisted result of the same statement is reused.
+    """
+    loop = asyncio.get_running_loop()
+    if result_registry is not None:
+        cursor = await loop.run_in_executor(
+            None, _reuse_result, connection, sql, result_registry
         )
+        if cursor is not None:
+            return cursor
+
+    cursor = connection.cursor()
+    await loop.run_in_executor(
+        None, partial(cursor.execute_async, sql, timeout=get_statement_timeout())
+    )
+    query_id = cursor.sfqid
 
-        return json.dumps(resp)
+    completed = False
+    try:
+        while True:
+            status = await loop.run_in_executor(
+                None, connection.get_query_status_throw_if_error, query_id
+            )
+            if not connection.is_still_running(status):
+                break
+            remaining = _check_deadline()
+            await asyncio.sleep(
+                poll_interval if remaining is None else min(poll_interval, remaining)
+            )
+        completed = True
+    finally:
+        if not completed:
+            loop.run_in_executor(None, _abort_query, cursor, query_id)
+
+    await loop.run_in_executor(None, cursor.get_results_from_sfqid, query_id)
+    if result_registry is not None:
+        result_registry.record(connection, sql, query_id)
+    return cursor
+
+
+def get_table_type(annotation: Any) -> Optional[type]:
+    """Returns pa.Table or pd.DataFrame if annotation accepts one of them."""
+    import pandas as pd
+
+    # types.UnionType (X | Y annotations) only exists on Python 3.10+
+    origin = get_origin(annotation)
+    if origin is not None and origin in (Union, getattr(types, "UnionType", None)):
+        candidates = get_args(annotation)
     else:
-        async with aiohttp.ClientSession(
-            headers=headers,
-        ) as session:
-            async with session.post(url=url, json=data) as response:
-                return await response.text()
+        candidates = (annotation,)
+    for candidate in candidates:
+        if candidate is pa.Table or candidate is pd.DataFrame:
+            return candidate
+    return None
+
+
+def convert_table(data: Any, table_type: type) -> Any:
+    """Converts a pa.Table or pd.DataFrame to table_type, or returns None.
+
+    data is returned as is when it already has the requested type.
+    """
+    import pandas as pd
+
+    if isinstance(data, table_type):
+        return data
+    if table_type is pd.DataFrame and isinstance(data, pa.Table):
+        return data.to_pandas()
+    if table_type is pa.Table and isinstance(data, pd.DataFrame):
+        return pa.Table.from_pandas(data, preserve_index=False)
+    return None
+
+
+SUMMARY_QUANTILES = (0.25, 0.5, 0.75)
+
+
+def _summary_value(value):
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, Decimal):
+        return round(float(value), 6)
+    return str(value)
+
+
+def _summarize_column(column: pa.ChunkedArray, top_n: int) -> Dict[str, Any]:
+    summary = {"type": str(column.type), "nulls": column.null_count}
+    if column.null_count == len(column):
+        return summary
+
+    if pa.types.is_decimal(column.type):
+        column = pc.cast(column, pa.float64())
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        min_max = pc.min_max(column)
+        summary["min"] = _summary_value(min_max["min"].as_py())
+        summary["max"] = _summary_value(min_max["max"].as_py())
+        summary["mean"] = _summary_value(pc.mean(column).as_py())
+        quantiles = pc.quantile(column, q=list(SUMMARY_QUANTILES)).to_pylist()
+        summary["quantiles"] = {
+            f"{int(q * 100)}%": _summary_value(v)
+            for q, v in zip(SUMMARY_QUANTILES, quantiles)
+        }
+    elif pa.types.is_temporal(column.type):
+        min_max = pc.min_max(column)
+        summary["min"] = _summary_value(min_max["min"].as_py())
+        summary["max"] = _summary_value(min_max["max"].as_py())
+    else:
+        try:
+            counts = pc.value_counts(column.drop_null())
+        except pa.ArrowNotImplementedError:
+            return summary
+        order = pc.array_sort_indices(counts.field("counts"), order="descending")
+        top = counts.take(order[:top_n])
+        summary["distinct"] = len(counts)
+        summary["top_values"] = [
+            [_summary_value(entry["values"]), entry["counts"]]
+            for entry in top.to_pylist()
+        ]
+    return summary
+
+
+def summarize_arrow_table(
+    table: pa.Table, top_n: int = 5, sample_rows: int = 5
+) -> Dict[str, Any]:
+    """Computes a compact columnar summary of an Arrow table.
+
+    The summary holds the row count, min/max/mean/quantiles of numeric columns,
+    the range of temporal columns, the most frequent values of the other columns
+    and the first and last rows, all computed with vectorized pyarrow kernels.
+    """
+    summary = {
+        "row_count": table.num_rows,
+        "columns": {
+            name: _summarize_column(table.column(name), top_n)
+            for name in table.column_names
+        },
+        "head": table.slice(0, sample_rows).to_pydict(),
+    }
+    if table.num_rows > sample_rows:
+        tail_start = max(table.num_rows - sample_rows, sample_rows)
+        summary["tail"] = table.slice(tail_start).to_pydict()
+    return summary
 
 
 def asyncify(self, sync_func):
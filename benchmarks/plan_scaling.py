@@ -0,0 +1,80 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures plan parsing and scheduling overhead on synthetic plans.
+
+Each plan is a fan-out tree: step i references the output of step i // 2, and a
+final fuse step depends on every action. Tools return immediately, so the
+timings only reflect the orchestration cost of the framework.
+
+Usage:
+    python benchmarks/plan_scaling.py [NUM_NODES ...]
+"""
+
+import os
+
+os.environ.setdefault("LOGGING_ENABLED", "False")
+
+import asyncio  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+from agent_gateway.gateway.output_parser import GatewayPlanParser  # noqa: E402
+from agent_gateway.gateway.task_processor import TaskProcessor  # noqa: E402
+from agent_gateway.tools.base import Tool  # noqa: E402
+
+DEFAULT_SIZES = [10, 100, 1000]
+
+
+async def _lookup(*args, **kwargs):
+    return "ok"
+
+
+def generate_plan(num_nodes: int) -> str:
+    lines = ["1. lookup('root')"]
+    for idx in range(2, num_nodes):
+        lines.append(f"{idx}. lookup('child of ${idx // 2}')")
+    lines.append(f"{num_nodes}. fuse()")
+    return "\n".join(lines) + "\n<END_OF_PLAN>\n"
+
+
+def run(num_nodes: int) -> tuple:
+    parser = GatewayPlanParser(
+        tools=[Tool(name="lookup", func=_lookup, description="")]
+    )
+    plan = generate_plan(num_nodes)
+
+    start = time.perf_counter()
+    tasks = parser.parse(plan)
+    parsed = time.perf_counter()
+
+    processor = TaskProcessor()
+    processor.set_tasks(tasks)
+    asyncio.run(processor.schedule())
+    scheduled = time.perf_counter()
+
+    assert processor._all_tasks_done() and len(tasks) == num_nodes
+    return parsed - start, scheduled - parsed
+
+
+def main(sizes):
+    print(f"{'nodes':>8} {'parse (ms)':>12} {'schedule (ms)':>14} {'total (ms)':>12}")
+    for num_nodes in sizes:
+        parse_time, schedule_time = run(num_nodes)
+        print(
+            f"{num_nodes:>8} {parse_time * 1000:>12.2f} "
+            f"{schedule_time * 1000:>14.2f} {(parse_time + schedule_time) * 1000:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
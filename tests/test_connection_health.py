@@ -0,0 +1,102 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from agent_gateway.tools.connection_health import ConnectionHealthManager
+from agent_gateway.tools.utils import CortexEndpointBuilder, SnowflakeConnectionPool
+
+
+class MockRest:
+    def __init__(self, token):
+        self.token = token
+        self.master_token = f"master_{token}"
+        self.master_validity_in_seconds = 14400
+        self.expired = False
+        self.heartbeats = 0
+        self.renewals = 0
+
+    def _heartbeat(self):
+        self.heartbeats += 1
+        return {"success": not self.expired}
+
+    def _renew_session(self):
+        if self.expired:
+            raise RuntimeError("Master token expired")
+        self.renewals += 1
+        self.token = f"{self.token}_renewed"
+
+    def update_tokens(self, token, master_token, master_validity_in_seconds=None):
+        self.token = token
+        self.master_token = master_token
+
+
+class MockConnection:
+    host = "example_host"
+    scheme = "https"
+
+    def __init__(self, token="token"):
+        self.rest = MockRest(token)
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    def is_valid(self):
+        return not self.rest.expired
+
+    def close(self):
+        self.closed = True
+
+
+def test_health_manager_renews_shared_session_tokens():
+    seed = MockConnection()
+    pool = SnowflakeConnectionPool(seed, max_size=2)
+    clone = MockConnection()
+    # stands in for a connection opened with the tokens of the seed
+    pool._open.append(clone)
+    manager = ConnectionHealthManager(pool, renewal_interval=0.05)
+
+    manager.check()
+    assert seed.rest.heartbeats == 1 and seed.rest.renewals == 0
+
+    time.sleep(0.06)
+    manager.check()
+    assert seed.rest.renewals == 1
+    assert clone.rest.token == seed.rest.token == "token_renewed"
+    headers = CortexEndpointBuilder(pool).get_analyst_headers()
+    assert headers["Authorization"] == 'Snowflake Token="token_renewed"'
+
+
+def test_health_manager_replaces_expired_connections():
+    tokens = iter(["second", "third", "fourth"])
+    pool = SnowflakeConnectionPool(
+        MockConnection("first"),
+        max_size=2,
+        connection_factory=lambda: MockConnection(next(tokens)),
+    )
+    borrowed = pool.acquire()
+    idle = pool.acquire()
+    pool.release(idle)
+    assert idle.rest.token == "second"
+
+    borrowed.rest.expired = True
+    idle.rest.expired = True
+    ConnectionHealthManager(pool).check()
+
+    # the idle connection is swapped right away, the borrowed one on release
+    assert idle.closed
+    assert pool.connection.rest.token == "third"
+    assert pool.acquire().rest.token == "fourth"
+    pool.release(borrowed)
+    assert pool.acquire().rest.token == "third"
+    assert pool.size == 2
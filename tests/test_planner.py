@@ -0,0 +1,113 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+from agent_gateway.gateway.output_parser import (
+    GatewayPlanParser,
+    _get_dependencies_from_graph,
+)
+from agent_gateway.gateway.planner import Planner, StreamingGraphParser
+from agent_gateway.tools.base import Tool
+
+PLAN = (
+    "Thought: I need the annual report and the market cap.\n"
+    "1. sec_cortexsearch('Snowflake product revenue')\n"
+    "2. sp500_cortexanalyst('Market cap of $1')\n"
+    "3. sec_cortexsearch('Snowflake customers')\n"
+    "4. fuse()\n"
+    "<END_OF_PLAN>"
+)
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+@pytest.fixture
+def tools():
+    return [
+        Tool(name=name, func=_noop, description="")
+        for name in ["sec_cortexsearch", "sp500_cortexanalyst", "summarize"]
+    ]
+
+
+def _describe(tasks):
+    return [(t.idx, t.name, t.args, list(t.dependencies)) for t in tasks]
+
+
+def test_streaming_parser_matches_batch_parser(tools):
+    parser = StreamingGraphParser(tools=tools)
+    streamed = []
+    for char in PLAN:
+        streamed.extend(parser.ingest_token(char))
+    streamed.extend(parser.finalize())
+
+    batch = GatewayPlanParser(tools=tools).parse(PLAN + "\n")
+    assert _describe(streamed) == _describe(batch.values())
+    assert [t.name for t in streamed] == [
+        "sec_cortexsearch",
+        "summarize",
+        "sp500_cortexanalyst",
+        "sec_cortexsearch",
+        "fuse",
+    ]
+
+
+def test_streaming_parser_state_is_per_instance(tools):
+    first = StreamingGraphParser(tools=tools)
+    first.ingest_token("Thought: first\n1. sec_cortexsearch('a')")
+    second = StreamingGraphParser(tools=tools)
+    assert second.buffer == ""
+    assert second.thought == ""
+
+
+def test_aplan_dispatches_tasks_before_plan_completes(tools):
+    planner = Planner(
+        session=None,
+        llm="",
+        example_prompt="",
+        example_prompt_replan="",
+        tools=tools,
+    )
+    first_task_seen = asyncio.Event()
+
+    async def astream_llm(inputs, is_replan=False):
+        yield "1. sec_cortexsearch('Snowflake customers')\n"
+        await asyncio.wait_for(first_task_seen.wait(), timeout=1)
+        yield "2. fuse()\n"
+
+    planner.astream_llm = astream_llm
+
+    async def run():
+        queue = asyncio.Queue()
+        planning = asyncio.create_task(
+            planner.aplan(inputs={"input": ""}, task_queue=queue, is_replan=False)
+        )
+        first = await queue.get()
+        first_task_seen.set()
+        rest = [await queue.get(), await queue.get()]
+        await planning
+        return [first] + rest
+
+    first, fuse, end = asyncio.run(run())
+    assert first.name == "sec_cortexsearch"
+    assert fuse.is_fuse
+    assert end is None
+
+
+def test_dependencies_only_include_preceding_steps():
+    args = "('Compare $1, ${12} and $3', '$15')"
+    assert _get_dependencies_from_graph("13", "lookup", args) == ["1", "3", "12"]
+    assert _get_dependencies_from_graph("4", "fuse", "") == ["1", "2", "3"]
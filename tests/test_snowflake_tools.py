@@ -0,0 +1,712 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from agent_gateway import Agent
+from agent_gateway.gateway.task_processor import Task
+from agent_gateway.tools import (
+    CortexAnalystTool,
+    CortexSearchTool,
+    FederatedSearchTool,
+    SearchEscalationPolicy,
+    SQLTool,
+)
+from agent_gateway.tools import snowflake_tools
+from agent_gateway.tools.sql_engines import SQLEngine, SQLResult
+from agent_gateway.tools.utils import SnowflakeConnectionPool
+
+SEARCH_SERVICES = [
+    {
+        "name": "OTHER_SERVICE",
+        "search_column": "BODY",
+        "definition": "SELECT * FROM DB.SCHEMA.OTHER",
+    },
+    {
+        "name": "TEST_SERVICE",
+        "search_column": "CHUNK",
+        "attribute_columns": "RELATIVE_PATH",
+        "definition": "SELECT CHUNK, RELATIVE_PATH FROM DB.SCHEMA.DOCS",
+        "target_lag": "1 hour",
+    },
+]
+
+
+class MockSearchConnection:
+    """Connection that answers SHOW CORTEX SEARCH SERVICES from a fixed list."""
+
+    database = "DB"
+    schema = "SCHEMA"
+    host = "example_host"
+    scheme = "https"
+
+    class Rest:
+        token = "dummy_token"
+
+    rest = Rest()
+
+    def __init__(self, services=SEARCH_SERVICES, delay=0.0):
+        self.services = services
+        self.queries = []
+        self.delay = delay
+
+    def cursor(self, cursor_class=None):
+        return MockSearchCursor(self)
+
+
+class MockSearchCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, sql, *args, **kwargs):
+        self.connection.queries.append(sql)
+        time.sleep(self.connection.delay)
+        pattern = sql.split("LIKE '")[1].rstrip("'").upper()
+        self.rows = [s for s in self.connection.services if s["name"] == pattern]
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.fixture
+def search_results(monkeypatch):
+    results = [
+        {"CHUNK": "first passage", "RELATIVE_PATH": "a.pdf"},
+        {"CHUNK": "second passage", "RELATIVE_PATH": "a.pdf"},
+    ]
+    requests = []
+
+    async def fake_post_cortex_request(url, headers, data, http_pool=None):
+        requests.append(data)
+        return json.dumps({"results": results})
+
+    monkeypatch.setattr(
+        snowflake_tools, "post_cortex_request", fake_post_cortex_request
+    )
+    monkeypatch.setattr(snowflake_tools, "_determine_runtime", lambda: False)
+    return requests
+
+
+def _search_tool(connection, **kwargs):
+    return CortexSearchTool(
+        service_name="TEST_SERVICE",
+        service_topic="test documents",
+        data_description="test documents",
+        retrieval_columns=["CHUNK", "RELATIVE_PATH"],
+        snowflake_connection=connection,
+        **kwargs,
+    )
+
+
+def test_search_metadata_is_loaded_once(search_results):
+    connection = MockSearchConnection()
+    tool = _search_tool(connection)
+
+    async def run():
+        return [await tool.asearch("question") for _ in range(3)]
+
+    responses = asyncio.run(run())
+
+    assert len(search_results) == 3
+    assert connection.queries == ["SHOW CORTEX SEARCH SERVICES LIKE 'TEST_SERVICE'"]
+    assert responses[0]["sources"]["metadata"] == [{"RELATIVE_PATH": "a.pdf"}]
+    assert tool._get_search_table("TEST_SERVICE") == "DB.SCHEMA.DOCS"
+    assert len(connection.queries) == 1
+
+
+def test_search_metadata_is_loaded_once_by_concurrent_searches(search_results):
+    connection = MockSearchConnection(delay=0.05)
+    tool = _search_tool(connection)
+
+    async def run():
+        return await asyncio.gather(*[tool.asearch("question") for _ in range(4)])
+
+    asyncio.run(run())
+
+    assert len(connection.queries) == 1
+
+
+def test_search_metadata_refresh(search_results):
+    connection = MockSearchConnection()
+    tool = _search_tool(connection, metadata_ttl=0.05)
+
+    asyncio.run(tool.asearch("question"))
+    asyncio.run(tool.asearch("question"))
+    assert len(connection.queries) == 1
+    time.sleep(0.06)
+    asyncio.run(tool.asearch("question"))
+    assert len(connection.queries) == 2
+
+    tool = _search_tool(connection)
+    tool.refresh_metadata()
+    connection.services = [dict(SEARCH_SERVICES[1], search_column="TEXT")]
+    assert tool._get_search_column("TEST_SERVICE") == ["CHUNK"]
+    tool.refresh_metadata()
+    assert tool._get_search_column("TEST_SERVICE") == ["TEXT"]
+
+
+def test_search_metadata_missing_service():
+    tool = _search_tool(MockSearchConnection(services=[]))
+
+    with pytest.raises(snowflake_tools.SnowflakeError):
+        tool._get_search_column("TEST_SERVICE")
+
+
+def test_search_result_cache(search_results):
+    tool = _search_tool(MockSearchConnection(), cache_results=True)
+
+    async def run():
+        first = await tool.asearch("What is  a passage?")
+        first["output"].clear()
+        second = await tool.asearch("What is a passage?")
+        await tool.asearch("what is a passage?")
+        tool.k = 10
+        await tool.asearch("What is a passage?")
+        return second
+
+    second = asyncio.run(run())
+
+    assert len(search_results) == 3
+    assert len(second["output"]) == 2
+    assert (tool.result_cache.hits, tool.result_cache.misses) == (1, 3)
+    assert tool._get_cache_ttl() == 3600
+
+
+def test_search_result_cache_expires(search_results):
+    tool = _search_tool(MockSearchConnection(), cache_results=True, cache_ttl=0.05)
+
+    asyncio.run(tool.asearch("question"))
+    asyncio.run(tool.asearch("question"))
+    time.sleep(0.06)
+    asyncio.run(tool.asearch("question"))
+
+    assert len(search_results) == 2
+
+
+def test_parse_target_lag():
+    assert snowflake_tools._parse_target_lag("1 hour") == 3600
+    assert snowflake_tools._parse_target_lag("5 Minutes") == 300
+    assert snowflake_tools._parse_target_lag("DOWNSTREAM") is None
+
+
+def test_batch_search_merges_results(search_results):
+    tool = _search_tool(MockSearchConnection(), batch_concurrency=2)
+
+    merged = asyncio.run(tool.abatch_search(["first", "second", "third"]))
+
+    assert [data["query"] for data in search_results] == ["first", "second", "third"]
+    assert len(merged["output"]) == 2
+    assert merged["sources"]["metadata"] == [{"RELATIVE_PATH": "a.pdf"}]
+
+
+def test_batch_call_returns_one_result_per_task(search_results):
+    tool = _search_tool(MockSearchConnection())
+
+    results = asyncio.run(tool.batch_func([(("first",), {}), ((), {"query": "x"})]))
+
+    assert [data["query"] for data in search_results] == ["first", "x"]
+    assert all(len(result["output"]) == 2 for result in results)
+
+
+def test_federated_search_fuses_ranked_results(monkeypatch):
+    results = {
+        "TEST_SERVICE": [
+            {"CHUNK": "shared", "RELATIVE_PATH": "a.pdf"},
+            {"CHUNK": "docs only", "RELATIVE_PATH": "b.pdf"},
+        ],
+        "OTHER_SERVICE": [
+            {"BODY": "other only", "RELATIVE_PATH": "c.pdf"},
+            {"CHUNK": "shared", "RELATIVE_PATH": "a.pdf"},
+        ],
+    }
+
+    async def fake_post_cortex_request(url, headers, data, http_pool=None):
+        service = "OTHER_SERVICE" if "OTHER_SERVICE" in url.upper() else "TEST_SERVICE"
+        return json.dumps({"results": results[service]})
+
+    monkeypatch.setattr(
+        snowflake_tools, "post_cortex_request", fake_post_cortex_request
+    )
+    monkeypatch.setattr(snowflake_tools, "_determine_runtime", lambda: False)
+
+    connection = MockSearchConnection()
+    other = _search_tool(connection)
+    other.service_name = "OTHER_SERVICE"
+    federated = FederatedSearchTool(
+        search_tools=[_search_tool(connection), other],
+        service_topic="test documents",
+        data_description="test documents",
+        k=2,
+    )
+
+    response = asyncio.run(federated("question"))
+
+    assert response["output"] == [
+        {"CHUNK": "shared", "RELATIVE_PATH": "a.pdf"},
+        {"BODY": "other only", "RELATIVE_PATH": "c.pdf"},
+    ]
+    assert response["sources"]["metadata"] == [
+        {"RELATIVE_PATH": "a.pdf", "Search Tool": "TEST_SERVICE"},
+        {"RELATIVE_PATH": "c.pdf", "Search Tool": "OTHER_SERVICE"},
+    ]
+
+
+def test_federated_search_escalates_with_its_search_tools(monkeypatch):
+    async def fake_post_cortex_request(url, headers, data, http_pool=None):
+        service = "OTHER" if "OTHER_SERVICE" in url.upper() else "TEST"
+        rows = [{"CHUNK": f"{service} {i}"} for i in range(data["limit"])]
+        return json.dumps({"results": rows})
+
+    monkeypatch.setattr(
+        snowflake_tools, "post_cortex_request", fake_post_cortex_request
+    )
+    monkeypatch.setattr(snowflake_tools, "_determine_runtime", lambda: False)
+
+    connection = MockSearchConnection()
+    policy = SearchEscalationPolicy(initial_k=2)
+    search = _search_tool(connection, escalation_policy=policy)
+    other = _search_tool(connection, escalation_policy=policy)
+    other.name = other.service_name = "OTHER_SERVICE"
+    federated = FederatedSearchTool(
+        search_tools=[search, other],
+        service_topic="test documents",
+        data_description="test documents",
+        k=2,
+    )
+
+    async def run():
+        token = snowflake_tools.start_search_escalation()
+        try:
+            first = await federated.asearch("question")
+            snowflake_tools.escalate_search([search.name, other.name])
+            second = await federated.asearch("question")
+        finally:
+            snowflake_tools.reset_search_escalation(token)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(first["output"]) == 2
+    assert len(second["output"]) == 4
+
+
+def test_search_filter_push_down(search_results):
+    tool = _search_tool(MockSearchConnection(), filter_attributes=["RELATIVE_PATH"])
+    search_filter = {"@eq": {"RELATIVE_PATH": "a.pdf"}}
+
+    asyncio.run(tool.func("question", search_filter))
+
+    assert search_results[0]["filter"] == search_filter
+    assert "filter: Optional[dict] = None" in tool.description
+    with pytest.raises(snowflake_tools.SnowflakeError):
+        asyncio.run(tool.asearch("question", {"@eq": {"SECRET": "x"}}))
+    with pytest.raises(snowflake_tools.SnowflakeError):
+        asyncio.run(tool.asearch("question", {"@like": {"RELATIVE_PATH": "x"}}))
+
+
+def test_search_citation_columns_are_not_sent_to_the_agent(search_results):
+    tool = CortexSearchTool(
+        service_name="TEST_SERVICE",
+        service_topic="test documents",
+        data_description="test documents",
+        retrieval_columns=["CHUNK"],
+        citation_columns=["RELATIVE_PATH"],
+        snowflake_connection=MockSearchConnection(),
+    )
+
+    response = asyncio.run(tool.asearch("question"))
+
+    assert search_results[0]["columns"] == ["CHUNK", "RELATIVE_PATH"]
+    assert response["output"] == [
+        {"CHUNK": "first passage"},
+        {"CHUNK": "second passage"},
+    ]
+    assert response["sources"]["metadata"] == [{"RELATIVE_PATH": "a.pdf"}]
+
+
+def test_search_escalation_policy_windows():
+    expand = SearchEscalationPolicy(initial_k=3, max_k=10)
+    page = SearchEscalationPolicy(initial_k=3, max_k=10, mode="page")
+
+    assert [expand.get_window(level) for level in range(4)] == [
+        (3, 0),
+        (6, 0),
+        (10, 0),
+        (10, 0),
+    ]
+    assert [page.get_window(level) for level in range(4)] == [
+        (3, 0),
+        (6, 3),
+        (9, 6),
+        (10, 7),
+    ]
+
+
+def test_search_escalates_after_replan(search_results):
+    tool = _search_tool(
+        MockSearchConnection(),
+        escalation_policy=SearchEscalationPolicy(initial_k=1, mode="page"),
+    )
+
+    async def run():
+        token = snowflake_tools.start_search_escalation()
+        try:
+            first = await tool.asearch("question")
+            snowflake_tools.escalate_search([tool.name])
+            second = await tool.asearch("question")
+        finally:
+            snowflake_tools.reset_search_escalation(token)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert [data["limit"] for data in search_results] == [1, 2]
+    assert second["output"] == [{"CHUNK": "second passage", "RELATIVE_PATH": "a.pdf"}]
+    assert tool._get_result_window() == (1, 0)
+
+
+class MockArrowCursor:
+    def __init__(self, num_rows, batch_size):
+        self.rowcount = num_rows
+        self.fetched_batches = 0
+        self.batch_size = batch_size
+
+    def fetch_arrow_batches(self):
+        for start in range(0, self.rowcount, self.batch_size):
+            self.fetched_batches += 1
+            size = min(self.batch_size, self.rowcount - start)
+            yield pa.table({"ID": list(range(start, start + size))})
+
+
+def _analyst_tool(monkeypatch, cursor, **kwargs):
+    async def fake_execute_query_async(connection, sql, **kwargs):
+        return cursor
+
+    monkeypatch.setattr(
+        snowflake_tools, "execute_query_async", fake_execute_query_async
+    )
+    return CortexAnalystTool(
+        semantic_model="model.yaml",
+        stage="STAGE",
+        service_topic="test data",
+        data_description="test data",
+        snowflake_connection=MockSearchConnection(),
+        **kwargs,
+    )
+
+
+def test_analyst_results_are_capped(monkeypatch):
+    cursor = MockArrowCursor(num_rows=10_000, batch_size=100)
+    tool = _analyst_tool(monkeypatch, cursor, max_results=150)
+    message = [{"type": "sql", "statement": "SELECT ID FROM DB.SCHEMA.T"}]
+
+    response = asyncio.run(tool._process_analyst_message(message))
+
+    assert cursor.fetched_batches == 2
+    assert response["output"].startswith(str({"ID": list(range(150))}))
+    assert response["output"].endswith("first 150 of 10000 rows.")
+
+
+def test_analyst_cap_on_a_batch_boundary(monkeypatch):
+    cursor = MockArrowCursor(num_rows=10_000, batch_size=100)
+    tool = _analyst_tool(monkeypatch, cursor, max_results=200)
+
+    table, note = tool._fetch_capped_table(cursor)
+
+    assert cursor.fetched_batches == 2
+    assert table.num_rows == 200
+    assert note.endswith("first 200 of 10000 rows.")
+
+
+def test_analyst_results_within_cap_are_unchanged(monkeypatch):
+    cursor = MockArrowCursor(num_rows=3, batch_size=2)
+    tool = _analyst_tool(monkeypatch, cursor, max_bytes=64)
+    message = [{"type": "sql", "statement": "SELECT ID FROM DB.SCHEMA.T"}]
+
+    response = asyncio.run(tool._process_analyst_message(message))
+
+    assert response["output"] == str({"ID": [0, 1, 2]})
+    tool.max_bytes = 16
+    cursor = MockArrowCursor(num_rows=3, batch_size=2)
+    table, note = tool._fetch_capped_table(cursor)
+    assert table.num_rows == 2
+    assert note.endswith("first 2 of 3 rows.")
+
+
+def test_analyst_summary_mode_keeps_full_table(monkeypatch):
+    cursor = MockArrowCursor(num_rows=500, batch_size=100)
+    tool = _analyst_tool(monkeypatch, cursor, result_format="auto")
+    message = [{"type": "sql", "statement": "SELECT ID FROM DB.SCHEMA.T"}]
+
+    response = asyncio.run(tool._process_analyst_message(message))
+
+    assert "'row_count': 500" in response["output"]
+    assert len(response["output"]) < 1000
+    assert response["data"].num_rows == 500
+
+
+class MockStageConnection(MockSearchConnection):
+    """Connection whose LIST returns a semantic model file with a given md5."""
+
+    def __init__(self):
+        super().__init__()
+        self.md5 = "v1"
+
+    def cursor(self, cursor_class=None):
+        connection = self
+
+        class Cursor:
+            def execute(self, sql):
+                connection.queries.append(sql)
+                return self
+
+            def fetchall(self):
+                return [
+                    {"name": "stage/model.yaml.bak", "md5": "old"},
+                    {"name": "stage/model.yaml", "md5": connection.md5},
+                ]
+
+        return Cursor()
+
+
+def test_analyst_sql_cache(monkeypatch):
+    requests = []
+
+    async def fake_post_cortex_request(url, headers, data, http_pool=None):
+        requests.append(data)
+        content = [
+            {"type": "text", "text": "This is the answer"},
+            {"type": "sql", "statement": "SELECT ID FROM DB.SCHEMA.T"},
+        ]
+        return json.dumps({"message": {"content": content}})
+
+    monkeypatch.setattr(
+        snowflake_tools, "post_cortex_request", fake_post_cortex_request
+    )
+    monkeypatch.setattr(snowflake_tools, "_determine_runtime", lambda: False)
+    tool = _analyst_tool(
+        monkeypatch,
+        MockArrowCursor(num_rows=3, batch_size=3),
+        cache_sql=True,
+        model_check_interval=0,
+    )
+    tool.connection = MockStageConnection()
+
+    async def run():
+        first = await tool.query("Market cap of  AAPL?")
+        second = await tool.query("Market cap of AAPL?")
+        tool.connection.md5 = "v2"
+        await tool.query("Market cap of AAPL?")
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(requests) == 2
+    assert first["output"] == second["output"] == str({"ID": [0, 1, 2]})
+    assert tool.connection.queries[0] == "LIST @DB.SCHEMA.STAGE/model.yaml"
+    assert tool.sql_cache.hits == 1
+
+
+class MockSQLConnection:
+    """Connection counting executions of a query and of its probe."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.executed = []
+        self.version = 1
+
+    def cursor(self):
+        return MockSQLCursor(self)
+
+    def is_closed(self):
+        return False
+
+
+class MockSQLCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.sql = None
+
+    def execute(self, sql, timeout=None):
+        self.connection.executed.append(sql)
+        self.sql = sql
+        return self
+
+    def fetchall(self):
+        return [(self.connection.version,)]
+
+    def fetch_pandas_all(self):
+        time.sleep(self.connection.delay)
+        return pd.DataFrame({"VERSION": [self.connection.version]})
+
+
+def _sql_tool(connection, **kwargs):
+    return SQLTool(
+        name="margin_eval",
+        sql_query="SELECT VERSION FROM T",
+        connection=connection,
+        tool_description="evaluate margins",
+        output_description="margins",
+        **kwargs,
+    )
+
+
+def test_sql_tool_serves_stale_result_while_refreshing():
+    connection = MockSQLConnection(delay=0.1)
+    tool = _sql_tool(connection, cache_ttl=0.05, max_staleness=10)
+
+    asyncio.run(tool())
+    time.sleep(0.06)
+    connection.version = 2
+    start = time.perf_counter()
+    stale = asyncio.run(tool())
+    assert time.perf_counter() - start < 0.05
+    assert stale["output"]["VERSION"].tolist() == [1]
+
+    while tool._refreshing:
+        time.sleep(0.01)
+    assert connection.executed.count("SELECT VERSION FROM T") == 2
+    fresh = asyncio.run(tool())
+    assert fresh["output"]["VERSION"].tolist() == [2]
+
+
+def test_sql_tool_refreshes_expired_result_once():
+    connection = MockSQLConnection(delay=0.1)
+    tool = _sql_tool(connection, cache_ttl=0.05)
+
+    async def run():
+        await tool()
+        await asyncio.sleep(0.06)
+        connection.version = 2
+        return await asyncio.gather(*[tool() for _ in range(3)])
+
+    responses = asyncio.run(run())
+
+    assert connection.executed.count("SELECT VERSION FROM T") == 2
+    assert all(r["output"]["VERSION"].tolist() == [2] for r in responses)
+
+
+class MockSQLEngine(SQLEngine):
+    """Engine returning the version of a MockSQLConnection without using it."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.executed = []
+
+    async def execute(self, sql):
+        self.executed.append(sql)
+        await asyncio.sleep(self.connection.delay)
+        result = MockSQLResult()
+        result.table = pa.table({"VERSION": [self.connection.version]})
+        return result
+
+    async def cancel(self, query_id):
+        pass
+
+
+class MockSQLResult(SQLResult):
+    async def batches(self):
+        yield self.table
+
+
+def test_sql_tool_background_refresh_outlives_sync_agent_calls(monkeypatch):
+    connection = MockSQLConnection(delay=0.2)
+    engine = MockSQLEngine(connection)
+    tool = _sql_tool(connection, cache_ttl=0.05, max_staleness=10, sql_engine=engine)
+
+    async def plan(inputs, is_replan, **kwargs):
+        return {
+            "1": Task(
+                idx="1",
+                name=tool.name,
+                tool=tool.func,
+                args=(),
+                kwargs={},
+                dependencies=[],
+            ),
+            "2": Task(
+                idx="2",
+                name="fuse",
+                tool=lambda x: None,
+                args=(),
+                kwargs=None,
+                dependencies=["1"],
+                is_fuse=True,
+            ),
+        }
+
+    async def arun(prompt):
+        return "Thought: done\n\nAction: Finish(done)"
+
+    agent = Agent(snowflake_connection=object(), tools=[tool], memory=False)
+    monkeypatch.setattr(agent.planner, "plan", plan)
+    monkeypatch.setattr(agent.agent, "arun", arun)
+
+    agent("question")
+    time.sleep(0.06)
+    connection.version = 2
+    # served from the stale result, the loop of the call is closed right after
+    agent("question")
+    while tool._refreshing:
+        time.sleep(0.01)
+    fresh = asyncio.run(tool())
+
+    assert fresh["output"]["VERSION"].tolist() == [2]
+    assert engine.executed == ["SELECT VERSION FROM T"] * 2
+    assert connection.executed == []
+
+
+def test_sql_tool_invalidation_probe():
+    connection = MockSQLConnection()
+    tool = _sql_tool(connection, cache_ttl=0, invalidation_probe="SELECT PROBE")
+
+    asyncio.run(tool())
+    asyncio.run(tool())
+    connection.version = 2
+    response = asyncio.run(tool())
+
+    assert connection.executed == [
+        "SELECT PROBE",
+        "SELECT VERSION FROM T",
+        "SELECT PROBE",
+        "SELECT PROBE",
+        "SELECT VERSION FROM T",
+    ]
+    assert response["output"]["VERSION"].tolist() == [2]
+
+
+def test_sql_tools_borrow_pooled_connections():
+    connections = []
+
+    def connect():
+        connections.append(MockSQLConnection(delay=0.1))
+        return connections[-1]
+
+    pool = SnowflakeConnectionPool(connect(), max_size=4, connection_factory=connect)
+    tools = [_sql_tool(pool) for _ in range(3)]
+
+    async def run():
+        return await asyncio.gather(*[tool() for tool in tools])
+
+    asyncio.run(run())
+
+    assert len(connections) == 3
+    assert all(c.executed == ["SELECT VERSION FROM T"] for c in connections)
+    assert pool.idle == 3
@@ -0,0 +1,221 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import datetime
+from decimal import Decimal
+
+import pyarrow as pa
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from agent_gateway.tools import CortexAnalystTool, SQLAPIEngine, SQLTool
+from agent_gateway.tools.sql_engines import _column_converter
+from agent_gateway.tools.utils import (
+    DeadlineExceededError,
+    HTTPSessionPool,
+    reset_request_deadline,
+    set_request_deadline,
+)
+
+ROW_TYPE = [
+    {"name": "ID", "type": "fixed", "precision": 38, "scale": 0},
+    {"name": "PRICE", "type": "fixed", "precision": 10, "scale": 2},
+    {"name": "NAME", "type": "text"},
+    {"name": "DAY", "type": "date"},
+]
+
+
+class MockSQLAPI:
+    """Snowflake SQL API answering every statement after a number of polls."""
+
+    def __init__(self, polls=1):
+        self.polls = polls
+        self.requests = []
+        self.statements = []
+        self.app = web.Application()
+        self.app.router.add_post("/api/v2/statements", self.submit)
+        self.app.router.add_get("/api/v2/statements/{handle}", self.status)
+        self.app.router.add_post("/api/v2/statements/{handle}/cancel", self.cancel)
+
+    async def submit(self, request):
+        self.requests.append(("POST", request.path_qs))
+        self.statements.append(await request.json())
+        return web.json_response({"statementHandle": "h1"}, status=202)
+
+    async def status(self, request):
+        self.requests.append(("GET", request.path_qs))
+        if "partition" in request.query:
+            return web.json_response({"data": [["3", None, "c", "19000"]]})
+        if self.polls > 0:
+            self.polls -= 1
+            return web.json_response({"statementHandle": "h1"}, status=202)
+        return web.json_response(
+            {
+                "statementHandle": "h1",
+                "resultSetMetaData": {
+                    "numRows": 3,
+                    "rowType": ROW_TYPE,
+                    "partitionInfo": [{"rowCount": 2}, {"rowCount": 1}],
+                },
+                "data": [["1", "1.50", "a", "0"], ["2", "20.00", None, "1"]],
+            }
+        )
+
+    async def cancel(self, request):
+        self.requests.append(("POST", request.path_qs))
+        return web.json_response({"statementHandle": "h1"})
+
+
+class MockConnection:
+    database = "DB"
+    schema = "SCHEMA"
+    warehouse = "WH"
+    role = None
+    scheme = "http"
+
+    class Rest:
+        token = "dummy_token"
+
+    rest = Rest()
+
+    def __init__(self, server):
+        self.host = f"{server.host}:{server.port}"
+
+
+def _run_with_api(api, test):
+    async def run():
+        async with TestServer(api.app) as server:
+            pool = HTTPSessionPool()
+            try:
+                return await test(MockConnection(server), pool)
+            finally:
+                await pool.aclose()
+
+    return asyncio.run(run())
+
+
+def test_sql_api_engine_polls_and_streams_partitions():
+    api = MockSQLAPI(polls=2)
+
+    async def test(connection, pool):
+        engine = SQLAPIEngine(connection, http_pool=pool, poll_interval=0.01)
+        result = await engine.execute("SELECT * FROM T")
+        return result, await result.to_arrow()
+
+    result, table = _run_with_api(api, test)
+
+    assert result.query_id == "h1"
+    assert table.to_pydict() == {
+        "ID": [1, 2, 3],
+        "PRICE": [Decimal("1.50"), Decimal("20.00"), None],
+        "NAME": ["a", None, "c"],
+        "DAY": [
+            datetime.date(1970, 1, 1),
+            datetime.date(1970, 1, 2),
+            datetime.date(2022, 1, 8),
+        ],
+    }
+    assert api.statements == [
+        {
+            "statement": "SELECT * FROM T",
+            "database": "DB",
+            "schema": "SCHEMA",
+            "warehouse": "WH",
+        }
+    ]
+    assert api.requests == [
+        ("POST", "/api/v2/statements?async=true"),
+        ("GET", "/api/v2/statements/h1"),
+        ("GET", "/api/v2/statements/h1"),
+        ("GET", "/api/v2/statements/h1"),
+        ("GET", "/api/v2/statements/h1?partition=1"),
+    ]
+
+
+def test_sql_api_column_conversions():
+    big_id = {"name": "ID", "type": "fixed", "precision": 38, "scale": 0}
+    small_id = {"name": "ID", "type": "fixed", "precision": 18, "scale": 0}
+    timestamp = {"name": "AT", "type": "timestamp_ntz"}
+
+    arrow_type, convert = _column_converter(big_id)
+    value = convert("99999999999999999999999999999999999999")
+    assert pa.array([value], type=arrow_type)[0].as_py() == value
+    assert _column_converter(small_id)[0] == pa.int64()
+    assert _column_converter(timestamp)[1]("-1.5") == datetime.datetime(
+        1969, 12, 31, 23, 59, 58, 500000
+    )
+    assert _column_converter(timestamp)[1]("1.000001000 1440") == (
+        datetime.datetime(1970, 1, 1, 0, 0, 1, 1)
+    )
+
+
+def test_sql_api_engine_cancels_on_deadline():
+    api = MockSQLAPI(polls=1000)
+
+    async def test(connection, pool):
+        engine = SQLAPIEngine(connection, http_pool=pool, poll_interval=0.01)
+        token = set_request_deadline(0.05)
+        try:
+            with pytest.raises(DeadlineExceededError):
+                await engine.execute("SELECT * FROM T")
+        finally:
+            reset_request_deadline(token)
+        await asyncio.sleep(0.05)
+
+    _run_with_api(api, test)
+
+    assert api.statements[0]["timeout"] == 1
+    assert api.requests[-1] == ("POST", "/api/v2/statements/h1/cancel")
+
+
+def test_sql_tool_with_sql_api_engine():
+    api = MockSQLAPI(polls=0)
+
+    async def test(connection, pool):
+        tool = SQLTool(
+            name="prices",
+            sql_query="SELECT * FROM T",
+            connection=connection,
+            tool_description="list prices",
+            output_description="prices",
+            sql_engine=SQLAPIEngine(connection, http_pool=pool),
+        )
+        return await tool()
+
+    response = _run_with_api(api, test)
+
+    assert response["output"]["ID"].tolist() == [1, 2, 3]
+
+
+def test_analyst_caps_sql_api_results():
+    api = MockSQLAPI(polls=0)
+
+    async def test(connection, pool):
+        tool = CortexAnalystTool(
+            semantic_model="model.yaml",
+            stage="STAGE",
+            service_topic="prices",
+            data_description="prices",
+            snowflake_connection=connection,
+            max_rows=2,
+            sql_engine=SQLAPIEngine(connection, http_pool=pool),
+        )
+        message = [{"type": "sql", "statement": "SELECT * FROM DB.SCHEMA.T"}]
+        return await tool._process_analyst_message(message)
+
+    response = _run_with_api(api, test)
+
+    assert response["data"]["ID"].to_pylist() == [1, 2]
+    assert "first 2 of 3 rows" in response["output"]
+    assert ("GET", "/api/v2/statements/h1?partition=1") not in api.requests
@@ -0,0 +1,331 @@
+# Copyright 2025 Snowflake Inc.
+# SPDX-License-Identifier: Apache-2.0
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from agent_gateway import Agent
+from agent_gateway.gateway.task_processor import Task, TaskGraph, TaskProcessor
+from agent_gateway.tools import PythonTool
+from agent_gateway.tools.utils import _check_deadline
+
+
+def _make_task(idx, dependencies, events, delay=0.0, name="tool"):
+    async def tool(*args):
+        events.append(("start", idx))
+        await asyncio.sleep(delay)
+        events.append(("end", idx))
+        return f"result {idx}"
+
+    return Task(
+        idx=idx,
+        name=name,
+        tool=tool,
+        args=(f"input for {idx}",),
+        kwargs={},
+        dependencies=dependencies,
+    )
+
+
+def _diamond(events):
+    return {
+        "1": _make_task("1", [], events, delay=0.02),
+        "2": _make_task("2", ["1"], events),
+        "3": _make_task("3", ["1"], events, delay=0.01),
+        "4": _make_task("4", ["2", "3"], events),
+    }
+
+
+def test_schedule_respects_dependencies():
+    events = []
+    processor = TaskProcessor()
+    processor.set_tasks(_diamond(events))
+    asyncio.run(processor.schedule())
+
+    order = [idx for kind, idx in events if kind == "start"]
+    assert order[0] == "1"
+    assert order[-1] == "4"
+    assert events.index(("end", "1")) < events.index(("start", "2"))
+    assert events.index(("end", "3")) < events.index(("start", "4"))
+    assert all(task.observation == f"result {i}" for i, task in processor.tasks.items())
+
+
+def test_aschedule_starts_tasks_as_they_arrive():
+    events = []
+    tasks = _diamond(events)
+
+    async def run():
+        processor = TaskProcessor()
+        queue = asyncio.Queue()
+        scheduling = asyncio.create_task(processor.aschedule(queue, func=None))
+        await queue.put(tasks["1"])
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert ("start", "1") in events
+        for idx in ["2", "3", "4"]:
+            await queue.put(tasks[idx])
+        await queue.put(None)
+        await scheduling
+        return processor
+
+    processor = asyncio.run(run())
+    assert processor._all_tasks_done()
+    assert events[-1] == ("end", "4")
+
+
+def test_failing_task_does_not_stall_schedule():
+    events = []
+
+    async def broken(*args):
+        raise ValueError("boom")
+
+    tasks = {
+        "1": Task(
+            idx="1", name="broken", tool=broken, args=(), kwargs={}, dependencies=[]
+        ),
+        "2": _make_task("2", ["1"], events),
+    }
+    processor = TaskProcessor()
+    processor.set_tasks(tasks)
+    asyncio.run(processor.schedule())
+    assert "boom" in processor.tasks["1"].observation
+    assert processor.tasks["2"].observation == "result 2"
+
+
+def test_task_graph_adjacency_lists():
+    graph = TaskGraph()
+    graph.add_task("1", [])
+    graph.add_task("2", ["1"])
+    assert graph.add_task("3", ["1", "2", "7"]) == ["1", "2"]
+    assert graph.dependents == {"1": ["2", "3"], "2": ["3"], "3": []}
+    assert graph.topological_order == ["1", "2", "3"]
+
+
+def test_concurrency_limit_prefers_critical_path():
+    events = []
+    tasks = {
+        "1": _make_task("1", [], events, delay=0.01, name="analyst"),
+        "2": _make_task("2", [], events, delay=0.01, name="analyst"),
+        "3": _make_task("3", [], events, delay=0.01, name="analyst"),
+        "4": _make_task("4", ["3"], events, name="python"),
+        "5": _make_task("5", ["4"], events, name="python"),
+    }
+    processor = TaskProcessor(concurrency_limits={"analyst": 1})
+    processor.set_tasks(tasks)
+    asyncio.run(processor.schedule())
+
+    starts = [idx for kind, idx in events if kind == "start"]
+    assert starts[0] == "3"
+    running = 0
+    for kind, idx in events:
+        if idx in {"1", "2", "3"}:
+            running += 1 if kind == "start" else -1
+            assert running <= 1
+
+
+def test_timed_out_task_does_not_block_fuse():
+    events = []
+    tasks = {
+        "1": _make_task("1", [], events, delay=10, name="slow"),
+        "2": _make_task("2", [], events, name="fast"),
+        "3": Task(
+            idx="3",
+            name="fuse",
+            tool=lambda x: None,
+            args=(),
+            kwargs=None,
+            dependencies=["1", "2"],
+            is_fuse=True,
+        ),
+    }
+    processor = TaskProcessor(task_timeout=5, tool_timeouts={"slow": 0.01})
+    processor.set_tasks(tasks)
+    asyncio.run(processor.schedule())
+
+    slow = processor.tasks["1"]
+    assert slow.timed_out
+    assert slow.observation["error"] == {"type": "timeout", "timeout": 0.01}
+    assert ("end", "1") not in events
+    assert processor.tasks["2"].observation == "result 2"
+    assert processor.tasks_done["3"].is_set()
+
+
+def _agent(monkeypatch, plan, arun, **kwargs):
+    """Agent whose planner and fuse are replaced by plan and arun."""
+    tool = PythonTool(
+        python_func=lambda: None, tool_description="tool", output_description="tool"
+    )
+    agent = Agent(snowflake_connection=object(), tools=[tool], memory=False, **kwargs)
+    monkeypatch.setattr(agent.planner, "plan", plan)
+    monkeypatch.setattr(agent.agent, "arun", arun)
+    return agent
+
+
+def _fuse_task(idx, dependencies):
+    return Task(
+        idx=idx,
+        name="fuse",
+        tool=lambda x: None,
+        args=(),
+        kwargs=None,
+        dependencies=dependencies,
+        is_fuse=True,
+    )
+
+
+def test_agent_answers_after_a_tool_runs_past_the_deadline(monkeypatch):
+    events = []
+
+    async def plan(inputs, is_replan, **kwargs):
+        return {
+            "1": _make_task("1", [], events, delay=5, name="slow"),
+            "2": _fuse_task("2", ["1"]),
+        }
+
+    async def arun(prompt):
+        # the Cortex request of fuse fails once the deadline has passed
+        _check_deadline()
+        return "Thought: the tool timed out\n\nAction: Finish(no answer in time)"
+
+    agent = _agent(monkeypatch, plan, arun, fuse_reserve=0.1)
+
+    start = time.monotonic()
+    response = asyncio.run(agent.acall("question", deadline=0.2))
+
+    assert response["output"] == "no answer in time"
+    assert ("end", "1") not in events
+    assert time.monotonic() - start < 1
+
+
+def test_concurrent_sync_calls_share_the_runtime_executor(monkeypatch):
+    async def plan(inputs, is_replan, **kwargs):
+        return {"1": _fuse_task("1", [])}
+
+    async def arun(prompt):
+        # like a request inside Snowflake, which runs on the pool's executor
+        executor = agent.http_pool.get_executor()
+        await asyncio.sleep(0.2 if "Question: slow" in prompt else 0.05)
+        answer = await asyncio.get_running_loop().run_in_executor(
+            executor, lambda: "answered"
+        )
+        return f"Thought: done\n\nAction: Finish({answer})"
+
+    agent = _agent(monkeypatch, plan, arun)
+    with ThreadPoolExecutor(max_workers=2) as callers:
+        responses = list(callers.map(agent, ["slow", "fast"]))
+    agent.close()
+
+    assert [response["output"] for response in responses] == ["answered"] * 2
+
+
+def test_sibling_tasks_are_batched():
+    events = []
+    batches = []
+
+    async def batch_tool(calls):
+        batches.append([args[0] for args, _ in calls])
+        return [f"batched {args[0]}" for args, _ in calls[:-1]] + [
+            ValueError("bad query")
+        ]
+
+    tasks = {
+        "1": _make_task("1", [], events),
+        "2": _make_task("2", ["1"], events, name="search"),
+        "3": _make_task("3", ["1"], events, name="search"),
+        "4": _make_task("4", ["1"], events, name="search"),
+        "5": _make_task("5", ["2", "3", "4"], events),
+    }
+    for idx in ["2", "3", "4"]:
+        tasks[idx].batch_tool = batch_tool
+
+    processor = TaskProcessor()
+    processor.set_tasks(tasks)
+    asyncio.run(processor.schedule())
+
+    assert batches == [["input for 2", "input for 3", "input for 4"]]
+    assert processor.tasks["2"].observation == "batched input for 2"
+    assert "bad query" in processor.tasks["4"].observation
+    assert processor.tasks["5"].observation == "result 5"
+    assert ("start", "2") not in events
+
+
+def test_observation_data_is_not_rendered():
+    task = _make_task("1", [], [])
+    task.observation = {"output": "3 rows", "data": ["row"] * 3, "sources": {}}
+
+    rendered = task.get_thought_action_observation()
+
+    assert "Observation: {'output': '3 rows', 'sources': {}}" in rendered
+
+
+def test_table_data_is_passed_to_python_tools():
+    table = pa.table({"PRICE": [1.5, 2.5]})
+    received = {}
+
+    def total_price(prices: pa.Table, frame: pd.DataFrame, label: str) -> float:
+        received.update(prices=prices, frame=frame, label=label)
+        return sum(prices["PRICE"].to_pylist())
+
+    python_tool = PythonTool(
+        python_func=total_price,
+        tool_description="adds up prices",
+        output_description="the total price",
+    )
+
+    async def analyst(*args):
+        return {"output": str(table.to_pydict()), "data": table, "sources": {}}
+
+    tasks = {
+        "1": Task(
+            idx="1", name="analyst", tool=analyst, args=(), kwargs={}, dependencies=[]
+        ),
+        "2": Task(
+            idx="2",
+            name="total_price",
+            tool=python_tool.func,
+            args=(),
+            kwargs={"prices": "$1", "frame": "${1}", "label": "total of $1"},
+            dependencies=["1"],
+            args_schema=python_tool.args_schema,
+        ),
+    }
+    processor = TaskProcessor()
+    processor.set_tasks(tasks)
+    asyncio.run(processor.schedule())
+
+    assert received["prices"] is table
+    assert received["frame"]["PRICE"].tolist() == [1.5, 2.5]
+    assert received["label"] == "total of {'PRICE': [1.5, 2.5]}"
+    assert processor.tasks["2"].observation["output"] == 4.0
+
+
+def test_critical_path_of_a_long_chain():
+    graph = TaskGraph()
+    for i in range(1, 5001):
+        graph.add_task(str(i), [str(i - 1)] if i > 1 else [])
+
+    assert graph.get_critical_path(["4999"]) == {"4999": 2}
+    start = time.perf_counter()
+    critical_path = graph.compute_critical_path()
+    assert time.perf_counter() - start < 0.5
+    assert critical_path["1"] == 5000
+    assert graph.get_critical_path(["1", "5000"]) == {"1": 5000, "5000": 1}
+
+
+def test_concurrency_limit_must_be_positive():
+    with pytest.raises(ValueError):
+        TaskProcessor(concurrency_limits={"tool": 0})
@@ -10,11 +10,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import json
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
 from urllib.parse import urlparse
 
+import pandas as pd
+import pyarrow as pa
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
-from agent_gateway.tools.utils import CortexEndpointBuilder
+from agent_gateway.tools import utils
+from agent_gateway.tools.utils import (
+    CortexEndpointBuilder,
+    DeadlineExceededError,
+    HTTPSessionPool,
+    QueryResultRegistry,
+    ConnectionPoolTimeoutError,
+    SSEDecoder,
+    SnowflakeConnectionPool,
+    TTLCache,
+    aborrow_connection,
+    execute_query,
+    execute_query_async,
+    get_remaining_time,
+    get_table_type,
+    post_cortex_request,
+    reset_request_deadline,
+    set_request_deadline,
+    stream_cortex_request,
+    summarize_arrow_table,
+)
 
 
 class MockConnection:
@@ -82,3 +113,404 @@ def test_search_headers(session):
     assert headers["Content-Type"] == "application/json"
     assert headers["Authorization"] == 'Snowflake Token="dummy_token"'
     assert headers["Accept"] == "application/json"
+
+
+def test_http_pool_reuses_session():
+    pool = HTTPSessionPool(limit_per_host=2)
+
+    async def run():
+        first = pool.get_session()
+        second = pool.get_session()
+        assert first is second
+        assert first.connector.limit_per_host == 2
+        await pool.aclose()
+        assert first.closed
+        return first
+
+    closed_session = asyncio.run(run())
+
+    async def reopen():
+        session = pool.get_session()
+        await pool.aclose()
+        return session
+
+    assert asyncio.run(reopen()) is not closed_session
+
+
+def test_http_pool_close_shuts_down_executor():
+    pool = HTTPSessionPool()
+    executor = pool.get_executor()
+    pool.close()
+
+    with pytest.raises(RuntimeError):
+        executor.submit(print)
+    assert pool.get_executor() is not executor
+    pool.close()
+
+
+def _sse_event(content):
+    payload = {"choices": [{"delta": {"content": content}}]}
+    return f"data: {json.dumps(payload)}\n\n".encode()
+
+
+def test_sse_decoder_handles_split_chunks():
+    body = _sse_event("Thought: ") + _sse_event("café")
+    decoder = SSEDecoder()
+    payloads = []
+    for i in range(0, len(body), 7):
+        payloads.extend(decoder.feed(body[i : i + 7]))
+    payloads.extend(decoder.flush())
+    deltas = [json.loads(p)["choices"][0]["delta"]["content"] for p in payloads]
+    assert deltas == ["Thought: ", "café"]
+
+
+def test_stream_cortex_request_yields_deltas():
+    async def complete(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for token in ["1. search(", "'query'", ")\n"]:
+            await response.write(_sse_event(token))
+        return response
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/api/v2/cortex/inference:complete", complete)
+        async with TestServer(app) as server, HTTPSessionPool() as pool:
+            url = str(server.make_url("/api/v2/cortex/inference:complete"))
+            stream = stream_cortex_request(url, {}, {}, http_pool=pool)
+            return [delta async for delta in stream]
+
+    assert asyncio.run(run()) == ["1. search(", "'query'", ")\n"]
+
+
+def test_request_deadline_is_inherited_by_tasks():
+    async def remaining_in_task():
+        return get_remaining_time()
+
+    async def run():
+        token = set_request_deadline(30)
+        try:
+            return await asyncio.create_task(remaining_in_task())
+        finally:
+            reset_request_deadline(token)
+
+    assert 29 < asyncio.run(run()) <= 30
+    assert get_remaining_time() is None
+
+
+def test_expired_deadline_stops_new_requests():
+    async def run():
+        token = set_request_deadline(0)
+        try:
+            await post_cortex_request("http://localhost/unused", {}, {})
+        finally:
+            reset_request_deadline(token)
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(run())
+
+
+@pytest.fixture
+def fake_snowflake_runtime(monkeypatch):
+    """Simulates the stored procedure runtime with a slow _snowflake module."""
+    calls = []
+
+    def send_snow_api_request(method, url, headers, params, body, options, timeout):
+        calls.append(timeout)
+        time.sleep(0.2)
+        return {"content": json.dumps({"url": url})}
+
+    runtime = types.ModuleType("_stored_proc_restful")
+    runtime.StoredProcRestful = object
+    snowflake_api = types.ModuleType("_snowflake")
+    snowflake_api.send_snow_api_request = send_snow_api_request
+    monkeypatch.setitem(sys.modules, "_stored_proc_restful", runtime)
+    monkeypatch.setitem(sys.modules, "_snowflake", snowflake_api)
+    return calls
+
+
+def test_runtime_requests_run_in_parallel(fake_snowflake_runtime):
+    pool = HTTPSessionPool(limit_per_host=4, request_timeout=12.5)
+
+    async def run():
+        return await asyncio.gather(
+            *[
+                post_cortex_request(f"/api/{i}", {}, {}, http_pool=pool)
+                for i in range(4)
+            ]
+        )
+
+    start = time.perf_counter()
+    responses = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.6
+    assert [json.loads(r)["content"] for r in responses][0] == '{"url": "/api/0"}'
+    assert fake_snowflake_runtime == [12500] * 4
+
+
+class MockAsyncQueryConnection:
+    """Connection whose queries finish `duration` seconds after submission."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.submitted = {}
+        self.aborted = []
+        self.expired = set()
+        self.schema = "PUBLIC"
+
+    def cursor(self):
+        return MockAsyncQueryCursor(self)
+
+    def get_query_status_throw_if_error(self, query_id):
+        elapsed = time.monotonic() - self.submitted[query_id]
+        return "RUNNING" if elapsed < self.duration else "SUCCESS"
+
+    @staticmethod
+    def is_still_running(status):
+        return status == "RUNNING"
+
+
+class MockAsyncQueryCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.sfqid = None
+        self.results_from = None
+
+    def execute_async(self, sql, timeout=None):
+        self.sfqid = f"query-{len(self.connection.submitted)}"
+        self.connection.submitted[self.sfqid] = time.monotonic()
+
+    def execute(self, sql, params=None, timeout=None):
+        if "RESULT_SCAN" in sql:
+            if params[0] in self.connection.expired:
+                raise RuntimeError("result expired")
+            self.results_from = params[0]
+        else:
+            self.execute_async(sql)
+        return self
+
+    def get_results_from_sfqid(self, query_id):
+        self.results_from = query_id
+
+    def abort_query(self, query_id):
+        self.connection.aborted.append(query_id)
+
+
+def test_execute_query_async_overlaps_queries():
+    connection = MockAsyncQueryConnection(duration=0.2)
+
+    async def run():
+        return await asyncio.gather(
+            *[
+                execute_query_async(connection, "SELECT 1", poll_interval=0.01)
+                for _ in range(3)
+            ]
+        )
+
+    start = time.perf_counter()
+    cursors = asyncio.run(run())
+    assert time.perf_counter() - start < 0.45
+    assert sorted(c.results_from for c in cursors) == ["query-0", "query-1", "query-2"]
+
+
+def test_execute_query_async_aborts_on_deadline():
+    connection = MockAsyncQueryConnection(duration=10)
+
+    async def run():
+        token = set_request_deadline(0.05)
+        try:
+            await execute_query_async(connection, "SELECT 1", poll_interval=0.01)
+        finally:
+            reset_request_deadline(token)
+            await asyncio.sleep(0.05)
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(run())
+    assert connection.aborted == ["query-0"]
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    time.sleep(0.06)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_summarize_arrow_table():
+    table = pa.table(
+        {
+            "AMOUNT": list(range(100)),
+            "REGION": ["EMEA"] * 60 + ["APAC"] * 30 + [None] * 10,
+        }
+    )
+
+    summary = summarize_arrow_table(table, top_n=1, sample_rows=2)
+
+    assert summary["row_count"] == 100
+    assert summary["columns"]["AMOUNT"]["min"] == 0
+    assert summary["columns"]["AMOUNT"]["max"] == 99
+    assert summary["columns"]["AMOUNT"]["quantiles"]["50%"] == 49.5
+    assert summary["columns"]["REGION"]["nulls"] == 10
+    assert summary["columns"]["REGION"]["top_values"] == [["EMEA", 60]]
+    assert summary["head"]["AMOUNT"] == [0, 1]
+    assert summary["tail"]["AMOUNT"] == [98, 99]
+
+
+def test_execute_query_async_reuses_persisted_results():
+    connection = MockAsyncQueryConnection(duration=0)
+    registry = QueryResultRegistry(window=60)
+
+    async def run():
+        first = await execute_query_async(
+            connection, "SELECT  'a  b' ;", poll_interval=0.01, result_registry=registry
+        )
+        second = await execute_query_async(
+            connection, "SELECT 'a  b'", poll_interval=0.01, result_registry=registry
+        )
+        third = await execute_query_async(
+            connection, "SELECT 'a b'", poll_interval=0.01, result_registry=registry
+        )
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+
+    assert list(connection.submitted) == ["query-0", "query-1"]
+    assert second.sfqid is None and second.results_from == first.sfqid
+    assert third.results_from == "query-1"
+
+
+def test_execute_query_reruns_expired_results():
+    connection = MockAsyncQueryConnection(duration=0)
+    registry = QueryResultRegistry(window=60)
+
+    execute_query(connection, "SELECT 1", result_registry=registry)
+    connection.expired.add("query-0")
+    execute_query(connection, "SELECT 1", result_registry=registry)
+    reused = execute_query(connection, "SELECT 1", result_registry=registry)
+
+    assert list(connection.submitted) == ["query-0", "query-1"]
+    assert reused.results_from == "query-1"
+
+
+def test_query_result_registry_key_and_window():
+    connection = MockAsyncQueryConnection(duration=0)
+    registry = QueryResultRegistry(window=60)
+    registry.record(connection, "SELECT * FROM T", "query-0")
+
+    connection.schema = "OTHER"
+    assert registry.get(connection, "SELECT * FROM T") is None
+    with pytest.raises(ValueError):
+        QueryResultRegistry(window=25 * 3600)
+
+
+class PooledConnection:
+    def __init__(self, valid=True):
+        self.valid = valid
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    def is_valid(self):
+        return self.valid
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_pool_hands_out_distinct_connections():
+    seed = PooledConnection()
+    pool = SnowflakeConnectionPool(
+        seed, max_size=2, acquire_timeout=0.05, connection_factory=PooledConnection
+    )
+
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is seed and second is not seed
+    with pytest.raises(ConnectionPoolTimeoutError):
+        pool.acquire()
+
+    pool.release(second)
+    assert pool.acquire() is second
+    assert pool.size == 2
+
+
+def test_connection_pool_waits_off_the_default_executor():
+    seed = PooledConnection()
+    pool = SnowflakeConnectionPool(seed, max_size=1, acquire_timeout=1)
+
+    async def borrow():
+        async with aborrow_connection(None, pool) as connection:
+            return connection
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+        borrowed = pool.acquire()
+        waiting = asyncio.gather(*[borrow() for _ in range(2)])
+        await asyncio.sleep(0.05)
+        # the default executor is still free while both borrowers wait
+        await asyncio.wait_for(loop.run_in_executor(None, pool.release, borrowed), 1)
+        return await waiting
+
+    assert asyncio.run(run()) == [seed, seed]
+    assert pool.idle == 1
+    pool.close()
+
+
+@pytest.mark.parametrize("has_union_type", [True, False])
+def test_get_table_type(monkeypatch, has_union_type):
+    if not has_union_type:
+        # Python 3.9 has no types.UnionType
+        monkeypatch.setattr(utils, "types", types.SimpleNamespace())
+
+    assert get_table_type(Optional[pd.DataFrame]) is pd.DataFrame
+    assert get_table_type(Union[str, pa.Table]) is pa.Table
+    assert get_table_type(pa.Table) is pa.Table
+    assert get_table_type(Optional[str]) is None
+    if has_union_type and sys.version_info >= (3, 10):
+        # X | Y annotations can not be written before Python 3.10
+        assert get_table_type(pd.DataFrame | None) is pd.DataFrame
+
+
+def test_connection_pool_health_check_and_idle_timeout():
+    seed = PooledConnection()
+    pool = SnowflakeConnectionPool(
+        seed,
+        max_size=3,
+        idle_timeout=0.05,
+        health_check_interval=0.0,
+        connection_factory=PooledConnection,
+    )
+    connections = [pool.acquire() for _ in range(3)]
+    for connection in connections:
+        pool.release(connection)
+
+    # connections above min_size are closed once idle for longer than idle_timeout
+    time.sleep(0.06)
+    pool.release(pool.acquire())
+    assert pool.size == 2
+    assert connections[1].closed and not connections[2].closed
+
+    connections[2].valid = False
+    assert pool.acquire() is seed
+    assert connections[2].closed
+    assert pool.size == 1